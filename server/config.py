@@ -4,7 +4,7 @@ import threading
 import platform
 import logging
 import aiofiles
-from typing import Optional
+from typing import Callable, Optional, Set
 
 # This is a singleton class to manage the configuration of the application.
 class ConfigManager:
@@ -17,6 +17,7 @@ class ConfigManager:
                 cls._instance = super(ConfigManager, cls).__new__(cls)
                 cls._instance._config_path = config_path
                 cls._instance._config = cls._get_default_config()
+                cls._instance._listeners = []
                 cls._instance.initialized = False
             return cls._instance
 
@@ -69,6 +70,9 @@ class ConfigManager:
             "default_shell": "powershell.exe" if platform.system().lower() == "windows" else "bash",
             "allowed_directories": [],
             "max_read_length": 1000,
+            "max_binary_read_size": 10 * 1024 * 1024,
+            "atomic_write": True,
+            "fsync_policy": "none",
         }
 
     def _load_config(self) -> None:
@@ -82,6 +86,7 @@ class ConfigManager:
                 self._config = {**default_config, **loaded_config}
             else:
                 self._config = loaded_config
+            self._notify_listeners(set(self._config))
         except FileNotFoundError:
             logging.warning(f"Configuration file not found at {self._config_path}, using default configuration")
         except json.JSONDecodeError as e:
@@ -114,14 +119,33 @@ class ConfigManager:
 
     def set_value(self, key: str, value) -> None:
         self._config[key] = value
+        self._notify_listeners({key})
 
     def update_config(self, updates: dict) -> dict:
         self._config.update(updates)
+        self._notify_listeners(set(updates))
         return self._config.copy()
 
     def reset_config(self) -> dict:
+        changed_keys = set(self._config)
         self._config = self._get_default_config()
+        self._notify_listeners(changed_keys | set(self._config))
         return self._config.copy()
+
+    def add_listener(self, listener: Callable[[Set[str]], None]) -> None:
+        """
+        Register a callback that is called with the changed keys whenever the configuration changes.
+
+        :param listener: The callback to register.
+        """
+        self._listeners.append(listener)
+
+    def _notify_listeners(self, keys: Set[str]) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(keys)
+            except Exception as e:
+                logging.error(f"Error notifying configuration listener: {e}")
     
     def get_allowed_directories(self) -> list:
         return self._config.get("allowed_directories", [])
@@ -5,11 +5,41 @@ project_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(project_dir))
 
 import argparse
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
 from typing_extensions import Literal
-from mcp.server.fastmcp import FastMCP
-from server.tools.file_system import read_file, write_file, delete_file, list_files, move_file, create_directory, FileResult
+from mcp.server.fastmcp import Context, FastMCP
+from server.tools.file_system import (
+    read_file_async,
+    write_file_async,
+    delete_file_async,
+    list_files_async,
+    move_file_async,
+    create_directory_async,
+    walk_files_async,
+    search_files_async,
+    batch_file_operations_async,
+    hash_files_async,
+    edit_file_async,
+    open_upload_async,
+    write_upload_chunk_async,
+    commit_upload_async,
+    abort_upload_async,
+    FileResult,
+    get_allowed_dirs_matcher,
+)
+from server.tools.table import (
+    table_aggregate_async,
+    table_head_async,
+    table_row_count_async,
+    table_schema_async,
+    table_stats_async,
+)
 from server.config import get_config_manager
 from server.tools.commands import execute_command, read_output, get_active_sessions, force_terminate
+from server.utils.execute_with_timeout import get_worker_pool
+from server.utils.fs_watcher import start_watcher
 
 mcp_server = FastMCP(
     "file_system",
@@ -17,77 +47,363 @@ mcp_server = FastMCP(
     version="0.1.0",
 )
 
+def progress_callback(ctx: Context) -> Callable[[float, Optional[float]], None]:
+    """
+    Build a thread-safe progress callback that sends MCP progress notifications through ctx.
+
+    :param ctx: The context of the current tool call.
+    :return: A callback taking the current progress and an optional total.
+    """
+    loop = asyncio.get_running_loop()
+
+    def report(progress: float, total: Optional[float] = None) -> None:
+        future = asyncio.run_coroutine_threadsafe(ctx.report_progress(progress, total), loop)
+        future.add_done_callback(lambda f: f.exception() and logging.debug(f"Progress not sent: {f.exception()}"))
+
+    return report
+
+
 # File system tools
 @mcp_server.tool()
-def read_file_tool(path: str, offset: int = 0, length: int = None, read_all: bool = None) -> FileResult:
+async def read_file_tool(
+        path: str,
+        offset: int = 0,
+        length: int = None,
+        read_all: bool = None,
+        byte_offset: int = None,
+        byte_length: int = None,
+        decompress: bool = True
+) -> FileResult:
     """
     Read a file and return its content.
     
     :param path: The path to the file to read.
-    :param offset: The offset from which to start reading.
+    :param offset: The offset from which to start reading, negative values count lines back from the end of the file (e.g. -200 reads the last 200 lines).
     :param length: Length Maximum number of lines to read (default: from config or 1000).
     :param read_all: If True, read the entire file, otherwise read from offset to length
-    :return: FileResult containing the file content, path, mime type, and whether it is an image.
+    :param byte_offset: If set, read a byte range starting here instead of lines (negative values count back from the end of the file).
+    :param byte_length: Maximum number of bytes to read in byte range mode (default: up to the end of the file).
+    :param decompress: If True, gzip, bzip2, xz and zstd compressed text files are decompressed and offset/length apply to the decompressed lines; set to False to get the compressed bytes.
+    :return: FileResult containing the file content, path, mime type, whether it is an image, the content encoding ('utf-8' or 'base64'), and the compression format of decompressed files.
     """
-    return read_file(path, offset, length, read_all)
+    return await read_file_async(path, offset, length, read_all, byte_offset, byte_length, decompress)
 
 
 @mcp_server.tool()
-def write_file_tool(file_path: str, content: str, mode: Literal["rewrite", "append"] = 'rewrite') -> bool:
+async def write_file_tool(
+        file_path: str,
+        content: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        atomic: bool = None
+) -> bool:
     """
     Write content to a file.
     
     :param file_path: The path to the file to write to.
     :param content: The content to write to the file.
     :param mode: The mode in which to write the file ('rewrite' or 'append').
+    :param atomic: Whether a rewrite goes to a temporary file that is renamed over the target, so readers never see a partial file (default: from config or True).
     :return: True if the file was written successfully, False otherwise.
     """
-    return True if write_file(file_path, content, mode) is None else False
+    return True if await write_file_async(file_path, content, mode, atomic) is None else False
+
+
+@mcp_server.tool()
+async def open_upload_tool(
+        file_path: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        encoding: Literal["utf-8", "base64"] = 'utf-8'
+) -> dict:
+    """
+    Start writing a large file in chunks. Send the chunks with upload_chunk_tool, then call
+    commit_upload_tool to replace the file atomically, or abort_upload_tool to discard them.
+    
+    :param file_path: The path to the file to write to.
+    :param mode: 'rewrite' to replace the file, 'append' to add the chunks to its current content (copied in the background).
+    :param encoding: How the chunks are encoded, 'utf-8' for text or 'base64' for binary data.
+    :return: A dict with the upload_id, the path and the current size of the upload.
+    """
+    return await open_upload_async(file_path, mode, encoding)
+
+
+@mcp_server.tool()
+async def upload_chunk_tool(upload_id: str, sequence: int, content: str) -> dict:
+    """
+    Write the next chunk of an upload.
+    
+    :param upload_id: The id returned by open_upload_tool.
+    :param sequence: The 0-based number of the chunk, resending a chunk that was already written is a no-op.
+    :param content: The chunk, encoded as given to open_upload_tool.
+    :return: A dict with the upload_id, the next expected sequence and the size written so far.
+    """
+    return await write_upload_chunk_async(upload_id, sequence, content)
+
+
+@mcp_server.tool()
+async def commit_upload_tool(upload_id: str) -> dict:
+    """
+    Finish an upload, atomically replacing the file with the uploaded content.
+    If the current content of an appending upload is still being copied, call it again later.
+    
+    :param upload_id: The id returned by open_upload_tool.
+    :return: A dict with the path, the size and the number of chunks written.
+    """
+    return await commit_upload_async(upload_id)
 
 
 @mcp_server.tool()
-def move_file_tool(source: str, destination: str) -> bool:
+async def abort_upload_tool(upload_id: str) -> bool:
     """
-    Move a file from source to destination.
+    Discard an upload, the file is left untouched.
     
-    :param source: The path to the source file.
-    :param destination: The path to the destination file.
+    :param upload_id: The id returned by open_upload_tool.
+    :return: True if the upload was discarded successfully, False otherwise.
+    """
+    return True if await abort_upload_async(upload_id) is None else False
+
+
+@mcp_server.tool()
+async def edit_file_tool(file_path: str, edits: List[dict] = None, diff: str = None) -> dict:
+    """
+    Edit a text file without sending all of its content, with line-range replacements or a unified diff.
+    The file is rewritten atomically on the server.
+    
+    :param file_path: The path to the file to edit.
+    :param edits: Line-range replacements, each {'start': 0-based line (as read_file_tool offsets), 'end': exclusive end line (default: start + 1), 'content': the new lines, empty to delete them}. Use start == end to insert.
+    :param diff: A unified diff of the file (e.g. from diff -u), its context and removed lines must match the file exactly.
+    :return: A dict with the path, the number of edits applied and the new size.
+    """
+    return await edit_file_async(file_path, edits, diff)
+
+
+@mcp_server.tool()
+async def move_file_tool(source: str, destination: str, ctx: Context) -> bool:
+    """
+    Move a file or a directory tree from source to destination, also across file systems.
+    
+    :param source: The path to the source file or directory.
+    :param destination: The path to the destination file or directory.
     :return: True if the file was moved successfully, False otherwise.
     """
-    return True if move_file(source, destination) is None else False
+    return True if await move_file_async(source, destination, progress_callback(ctx)) is None else False
 
 
 @mcp_server.tool()
-def delete_file_tool(file_path: str) -> bool:
+async def delete_file_tool(file_path: str) -> bool:
     """
     Delete a file.
     
     :param file_path: The path to the file to delete.
     :return: True if the file was deleted successfully, False otherwise.
     """
-    return True if delete_file(file_path) is None else False
+    return True if await delete_file_async(file_path) is None else False
 
 
 @mcp_server.tool()
-def list_files_tool(directory: str) -> list:
+async def list_files_tool(
+        directory: str,
+        limit: int = None,
+        cursor: str = None,
+        pattern: str = None,
+        sort_by: Literal["name", "size", "modified"] = None,
+        reverse: bool = False
+) -> list:
     """
     List files in a directory.
     
     :param directory: The path to the directory to list files from.
+    :param limit: Maximum number of items to return (default: all).
+    :param cursor: To get the next page, pass the name of the last item of the previous page (with the same pattern and sort options).
+    :param pattern: Glob pattern the file names must match, e.g. '*.csv'.
+    :param sort_by: Sort by 'name', 'size' or 'modified' (default: directory order, name order when paging).
+    :param reverse: Sort in descending order.
     :return: A list of file names in the directory.
     """
-    return list_files(directory)
+    return await list_files_async(directory, limit, cursor, pattern, sort_by, reverse)
 
 
 @mcp_server.tool()
-def create_directory_tool(directory: str) -> bool:
+async def create_directory_tool(directory: str) -> bool:
     """
     Create a directory.
     
     :param directory: The path to the directory to create.
     :return: True if the directory was created successfully, False otherwise.
     """
-    return True if create_directory(directory) is None else False
+    return True if await create_directory_async(directory) is None else False
+
+
+@mcp_server.tool()
+async def walk_tool(
+        directory: str,
+        ctx: Context,
+        max_depth: int = None,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = None
+) -> dict:
+    """
+    Recursively list a directory tree in one call, scanning directories in parallel.
+    
+    :param directory: The root directory to walk.
+    :param max_depth: Maximum depth to descend, 1 only lists the directory itself (default: unlimited).
+    :param include: Glob patterns the returned entries must match, e.g. ['*.py'] (default: all).
+    :param exclude: Glob patterns of entries to skip and directories not to descend into, e.g. ['.git', 'node_modules'].
+    :param max_results: Maximum number of entries to return (default: from config or 10000).
+    :return: A dict with the root, the entries (with relative_path and depth) and whether the result was truncated.
+    """
+    return await walk_files_async(directory, max_depth, include, exclude, max_results, progress_callback(ctx))
+
+
+@mcp_server.tool()
+async def search_tool(
+        path: str,
+        pattern: str,
+        regex: bool = True,
+        case_sensitive: bool = True,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = 100
+) -> dict:
+    """
+    Search the content of a file, or of all text files below a directory, like grep.
+    
+    :param path: The file or directory to search.
+    :param pattern: The regular expression (or literal text if regex is False) to search for, matched line by line like grep: ^ and $ match at each line, matches never span lines.
+    :param regex: Whether the pattern is a regular expression.
+    :param case_sensitive: Whether the search is case sensitive.
+    :param include: Glob patterns of the files to search, e.g. ['*.py'] (default: all).
+    :param exclude: Glob patterns of files to skip and directories not to descend into, e.g. ['.git'].
+    :param max_results: Maximum number of matches to return, the search stops once they are found.
+    :return: A dict with the matches (path, 0-based line usable as read_file_tool offset, text), the number of files searched and whether the result was truncated.
+    """
+    return await search_files_async(path, pattern, regex, case_sensitive, include, exclude, max_results)
+
+
+@mcp_server.tool()
+async def hash_tool(paths: List[str], ctx: Context, algorithm: str = 'sha256') -> dict:
+    """
+    Compute checksums on the server instead of reading the files, e.g. to verify datasets.
+    Files are hashed in parallel and digests of unchanged files are cached.
+    
+    :param paths: The files or directories to hash, directories are hashed file by file recursively.
+    :param algorithm: 'sha256', 'sha1', 'md5', 'blake2b', 'blake2s', or 'xxh64', 'xxh3_64', 'xxh3_128' if xxhash is installed.
+    :return: A dict with the algorithm, the results (path, size, digest, cached, or path and error) and whether the result was truncated.
+    """
+    return await hash_files_async(paths, algorithm, progress_callback(ctx))
+
+
+@mcp_server.tool()
+async def batch_tool(operations: List[dict]) -> List[dict]:
+    """
+    Run many file operations in one call. Operations on the same path (or a directory and something
+    below it) run in order, the others run concurrently.
+    
+    :param operations: The operations, each a dict with 'op' and its arguments:
+        {'op': 'read', 'path', 'offset', 'length', 'read_all', 'byte_offset', 'byte_length', 'decompress'},
+        {'op': 'write', 'path', 'content', 'mode', 'atomic'}, {'op': 'edit', 'path', 'edits' or 'diff'},
+        {'op': 'move', 'source', 'destination'},
+        {'op': 'delete', 'path'} or {'op': 'create_directory', 'path'}.
+    :return: One result per operation, in order, with index, op, ok and either result or error.
+    """
+    return await batch_file_operations_async(operations)
+
+
+# Table analysis tools
+@mcp_server.tool()
+async def table_schema_tool(path: str, delimiter: str = None, sample_rows: int = 1000) -> dict:
+    """
+    Infer the column names and types of a CSV file from its first rows.
+    
+    :param path: The path to the CSV file, gzip, bzip2, xz and zstd compressed files are read transparently.
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise).
+    :param sample_rows: Number of rows parsed to infer the column types.
+    :return: A dict with the path, the columns (name, dtype, nullable) and the number of rows sampled.
+    """
+    return await table_schema_async(path, delimiter, sample_rows)
+
+
+@mcp_server.tool()
+async def table_row_count_tool(path: str, delimiter: str = None) -> dict:
+    """
+    Count the data rows of a CSV file without returning its content.
+    
+    :param path: The path to the CSV file.
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise).
+    :return: A dict with the path and the number of rows, without the header.
+    """
+    return await table_row_count_async(path, delimiter)
+
+
+@mcp_server.tool()
+async def table_stats_tool(
+        path: str,
+        ctx: Context,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None
+) -> dict:
+    """
+    Compute per-column statistics of a CSV file on the server instead of reading it.
+    Tables larger than 256 MiB are aggregated chunk by chunk like table_aggregate_tool, with the same fields and approximate set.
+    
+    :param path: The path to the CSV file.
+    :param columns: The columns to describe (default: all).
+    :param quantiles: The quantiles of numeric columns, between 0 and 1 (default: [0.25, 0.5, 0.75]).
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise).
+    :param dtypes: The pandas dtypes of some columns, e.g. {'id': 'string', 'price': 'float64'} (default: inferred).
+    :return: A dict with the path, the number of rows, approximate, truncated and per column the dtype, count, null_count, distinct and either min, max, mean, std and quantiles (numeric columns) or the most frequent value (top, top_count).
+    """
+    return await table_stats_async(path, columns, quantiles, delimiter, dtypes, progress_callback(ctx))
+
+
+@mcp_server.tool()
+async def table_aggregate_tool(
+        path: str,
+        ctx: Context,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None,
+        chunk_rows: int = None
+) -> dict:
+    """
+    Compute per-column statistics of a CSV file of any size in bounded memory, reading it in chunks.
+    Only the selected columns are parsed, distinct counts (HyperLogLog), quantiles (t-digest) and the count of the most frequent value of non-numeric columns are approximate.
+    
+    :param path: The path to the CSV file.
+    :param columns: The columns to describe (default: all), fewer columns parse faster.
+    :param quantiles: The quantiles of numeric columns, between 0 and 1 (default: [0.25, 0.5, 0.75]).
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise).
+    :param dtypes: The pandas dtypes of some columns, e.g. {'id': 'string'} (default: numeric columns of the first rows are read as float64, the others as strings).
+    :param chunk_rows: Rows parsed at a time, memory use grows with it (default: from config or 100000).
+    :return: A dict with the path, the number of rows, approximate, truncated (the time ran out before the end of the file) and per column the dtype, count, null_count, distinct and for numeric columns min, max, mean, std, sum and quantiles.
+    """
+    return await table_aggregate_async(path, columns, quantiles, delimiter, dtypes, chunk_rows, progress_callback(ctx))
+
+
+@mcp_server.tool()
+async def table_head_tool(
+        path: str,
+        rows: int = 10,
+        sample: bool = False,
+        seed: int = None,
+        columns: List[str] = None,
+        delimiter: str = None
+) -> dict:
+    """
+    Return the first rows of a CSV file, or a uniform random sample of its rows.
+    
+    :param path: The path to the CSV file.
+    :param rows: Number of rows to return, at most 1000.
+    :param sample: If True, return randomly chosen rows (in file order) instead of the first ones.
+    :param seed: Seed of the random sample, for repeatable samples.
+    :param columns: The columns to return (default: all).
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise).
+    :return: A dict with the path, the column names and the rows as dicts.
+    """
+    return await table_head_async(path, rows, sample, seed, columns, delimiter)
 
 
 # Configuration management tools
@@ -114,6 +430,16 @@ def set_config_tool(key: str, value) -> dict:
     return config_manager.config
 
 
+@mcp_server.tool()
+def get_worker_metrics_tool() -> dict:
+    """
+    Get the metrics of the shared worker pool that runs file operations.
+
+    :return: A dict with the pool size and the number of queued, in-flight, completed and abandoned tasks.
+    """
+    return get_worker_pool().metrics()
+
+
 # Command execution tools
 @mcp_server.tool()
 def execute_command_tool(command: str, timeout: float, shell: str = None) -> dict:
@@ -169,6 +495,8 @@ def main():
     parser.add_argument("--config", help="Path to config file", default=None)
     args = parser.parse_args()
     get_config_manager(config_path=args.config)
+    # Publish changes made outside the server to the file caches
+    start_watcher(lambda: get_allowed_dirs_matcher().roots)
     mcp_server.run(transport='stdio')
 
 
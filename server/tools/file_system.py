@@ -1,11 +1,69 @@
-import base64
-from dataclasses import dataclass
+import binascii
+import concurrent.futures
+import errno
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import fnmatch
+import hashlib
+import heapq
+import io
 import logging
+import mmap
 import os
-from typing import Literal
+import re
+import shutil
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Literal, Optional, Set, Tuple, Union
 from server.config import get_config_manager
-from server.tools.mime_types import get_mime_type,is_image_file
-from server.utils.execute_with_timeout import execute_with_timeout
+from server.tools.mime_types import get_mime_type, is_image_file, is_searchable_text, is_text_type, sniff_content
+from server.utils.compressed import (
+    COMPRESSION_FORMATS, decompression_available, inner_mime_type, read_compressed_all, read_compressed_lines,
+    sniff_compressed
+)
+from server.utils.atomic_write import AtomicFile, fsync_file, get_fsync_policy, write_group
+from server.utils.execute_with_timeout import (
+    execute_with_timeout, execute_with_timeout_async, get_parallel_pool, soft_deadline
+)
+from server.utils.file_copy import is_same_device, move_across_devices
+from server.utils.file_cache import DirectoryCache, FileCache, file_identity
+from server.utils.fs_watcher import add_change_listener, change_sequence, publish_change
+from server.utils.path_matcher import AllowedDirMatcher
+from server.utils.upload_manager import upload_manager
+from server.utils.search_index import get_search_index, required_literals
+from server.utils.line_index import get_line_index, read_lines, read_tail_lines, read_text_lines
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+#TODO: 可以使用配置文件
+FILE_READ_TIMEOUT = 10  # seconds
+FILE_WRITE_TIMEOUT = 30  # seconds
+FILE_MOVE_TIMEOUT = 30  # seconds
+FILE_CROSS_DEVICE_MOVE_TIMEOUT = 6 * 60 * 60  # seconds
+FILE_DELETE_TIMEOUT = 10  # seconds
+FILE_LIST_TIMEOUT = 10  # seconds
+FILE_CREATE_TIMEOUT = 10  # seconds
+FILE_WALK_TIMEOUT = 60  # seconds
+FILE_SEARCH_TIMEOUT = 60  # seconds
+FILE_BATCH_TIMEOUT = 120  # seconds
+FILE_HASH_TIMEOUT = 600  # seconds
+FILE_EDIT_TIMEOUT = 60  # seconds
+
+# Number of entries collected per chunk while walking a directory tree
+WALK_CHUNK_SIZE = 1000
+# Matched lines longer than this are cut in search results
+SEARCH_MAX_LINE_LENGTH = 500
+# Bytes of a mapped file copied at a time to count the lines between two matches
+SEARCH_COUNT_CHUNK_SIZE = 1024 * 1024
+# Maximum number of operations in one batch
+MAX_BATCH_OPERATIONS = 1000
+# Bytes passed to the hash per update, also the granularity of progress reports
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+HASH_ALGORITHMS = ("sha256", "sha1", "md5", "blake2b", "blake2s", "xxh64", "xxh3_64", "xxh3_128")
 
 
 def normalize_path(path: str) -> str:
@@ -31,7 +89,7 @@ def get_allowed_dirs() -> list:
     """
     try:
         config = get_config_manager()
-        allowed_dirs = config.config.get("allowed_directories", [])
+        allowed_dirs = config.get_value("allowed_directories") or []
         # If no allowed dirs are set, use the home directory
         if not allowed_dirs:
             allowed_dirs = [os.environ['HOME']]
@@ -43,6 +101,36 @@ def get_allowed_dirs() -> list:
     return []
 
 
+_allowed_dirs_matcher: Optional[AllowedDirMatcher] = None
+# Reentrant, get_allowed_dirs may update the configuration and notify _on_config_change
+_allowed_dirs_lock = threading.RLock()
+_allowed_dirs_listening = False
+
+
+def _on_config_change(keys: Set[str]) -> None:
+    global _allowed_dirs_matcher
+    if "allowed_directories" in keys:
+        with _allowed_dirs_lock:
+            _allowed_dirs_matcher = None
+
+
+def get_allowed_dirs_matcher() -> AllowedDirMatcher:
+    """
+    Get the compiled matcher for the allowed directories, it is rebuilt only after
+    allowed_directories changes in the configuration
+    """
+    global _allowed_dirs_matcher, _allowed_dirs_listening
+    # Compile under the lock so a concurrent change cannot be overwritten by a stale matcher
+    with _allowed_dirs_lock:
+        if not _allowed_dirs_listening:
+            get_config_manager().add_listener(_on_config_change)
+            _allowed_dirs_listening = True
+        if _allowed_dirs_matcher is None:
+            allowed_dirs = get_allowed_dirs()
+            _allowed_dirs_matcher = AllowedDirMatcher(allowed_dirs)
+        return _allowed_dirs_matcher
+
+
 def is_path_allowed(path: str) -> bool:
     """
     Check if the path is allowed to access
@@ -50,15 +138,27 @@ def is_path_allowed(path: str) -> bool:
     :param path: The path to check
     :return: True if the path is allowed, False otherwise
     """
-    allowed_dirs = get_allowed_dirs()
-    if "/" in allowed_dirs or not allowed_dirs:
-        # If the allowed dirs are empty or contain "/", allow all paths
+    return get_allowed_dirs_matcher().matches(normalize_path(path))
+
+
+_existing_dirs = DirectoryCache()
+add_change_listener(_existing_dirs.invalidate)
+
+
+def directory_exists(path: str) -> bool:
+    """
+    Check if a directory exists, directories found to exist are cached for a few seconds,
+    or until a change is published while they are watched
+
+    :param path: The normalized path to check
+    :return: True if the directory exists, False otherwise
+    """
+    if _existing_dirs.contains(path):
+        return True
+    sequence = change_sequence()
+    if os.path.isdir(path):
+        _existing_dirs.add(path, sequence)
         return True
-    path = normalize_path(path)
-    for allowed_dir in allowed_dirs:
-        if path == allowed_dir or path.startswith(allowed_dir + os.sep):
-            # If the path is the same as the allowed dir or starts with it, allow it
-            return True
     return False
 
 
@@ -72,7 +172,7 @@ def validate_parent_dirs(path: str) -> bool:
     parent = os.path.dirname(path)
     if parent == path or parent == os.path.dirname(parent):
         return False
-    if os.path.exists(parent):
+    if directory_exists(parent):
         return True
     return validate_parent_dirs(parent)
 
@@ -93,6 +193,75 @@ def is_path_valid(path: str) -> bool:
     return True
 
 
+# Must be a multiple of 3 so that chunks encode without padding
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
+
+@contextmanager
+def map_file(path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """
+    Memory-map a file read-only, so ranges can be served from the OS page cache
+    without copying the whole file into Python memory
+
+    :param path: The path to the file
+    :return: A context manager yielding the mapped file (or b"" for an empty file)
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def count_newlines(data: Union[mmap.mmap, bytes], start: int, end: int) -> int:
+    """
+    Count the newlines in data[start:end] without copying more than SEARCH_COUNT_CHUNK_SIZE bytes at a time
+    """
+    count = 0
+    for chunk_start in range(start, end, SEARCH_COUNT_CHUNK_SIZE):
+        count += data[chunk_start:min(chunk_start + SEARCH_COUNT_CHUNK_SIZE, end)].count(b'\n')
+    return count
+
+
+def resolve_byte_range(size: int, byte_offset: Optional[int], byte_length: Optional[int]) -> Tuple[int, int]:
+    """
+    Resolve a requested byte range against the file size
+
+    :param size: The size of the file in bytes
+    :param byte_offset: Starting byte, negative values count back from the end of the file
+    :param byte_length: Maximum number of bytes, None reads up to the end of the file
+    :return: A (start, end) tuple clamped to the file size
+    """
+    byte_offset = byte_offset or 0
+    start = byte_offset if byte_offset >= 0 else max(size + byte_offset, 0)
+    start = min(start, size)
+    end = size if byte_length is None else min(start + byte_length, size)
+    return start, end
+
+
+def encode_base64(data) -> str:
+    """
+    Encode bytes-like data as a base64 string chunk by chunk
+
+    Chunks are encoded straight into a preallocated output buffer, so no full-size
+    intermediate copy of the input or of the encoded bytes is made.
+
+    :param data: The bytes-like data to encode (e.g. a mapped file)
+    :return: The base64 encoded string
+    """
+    with memoryview(data) as view:
+        size = view.nbytes
+        encoded = bytearray(4 * ((size + 2) // 3))
+        pos = 0
+        for start in range(0, size, BASE64_CHUNK_SIZE):
+            chunk = binascii.b2a_base64(view[start:start + BASE64_CHUNK_SIZE], newline=False)
+            encoded[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+    return encoded.decode('ascii')
+
+
 # MCP Tools
 @dataclass
 class FileResult:
@@ -103,18 +272,109 @@ class FileResult:
     file_path: str
     mini_type: str
     is_image: bool
+    encoding: Literal["utf-8", "base64"] = "utf-8"
+    # Byte-based reads (images, binary files and byte ranges) report which range was returned
+    file_size: Optional[int] = None
+    byte_offset: Optional[int] = None
+    byte_length: Optional[int] = None
+    is_partial: bool = False
+    # Set when the content was decompressed from a compressed file, e.g. 'gzip'
+    compression: Optional[str] = None
 
 
-def read_file_from_disk(path: str, offset: int = 0, length: int = None, read_all: bool = None) -> FileResult:
+@dataclass
+class FileOperation:
+    """
+    A validated file operation, ready to run on the worker pool
+    """
+    func: Callable[[], Any]
+    timeout: float
+    default_value: Any = None
+
+    def run(self) -> Any:
+        return execute_with_timeout(self.func, timeout=self.timeout, default_value=self.default_value)
+
+    async def run_async(self) -> Any:
+        return await execute_with_timeout_async(self.func, timeout=self.timeout, default_value=self.default_value)
+
+
+@dataclass
+class DeferredFileOperation:
+    """
+    A file operation whose validation touches the disk (stat, content sniffing, header
+    reads), so it is validated on the worker pool too instead of by the caller, which may
+    be the event loop
+    """
+    prepare: Callable[[], FileOperation]
+    # Timeout of the validation, the operation it returns runs under its own timeout
+    timeout: float
+
+    def func(self) -> Any:
+        return self.prepare().func()
+
+    def run(self) -> Any:
+        return execute_with_timeout(self.prepare, timeout=self.timeout).run()
+
+    async def run_async(self) -> Any:
+        operation = await execute_with_timeout_async(self.prepare, timeout=self.timeout)
+        return await operation.run_async()
+
+
+def read_file_from_disk(
+        path: str,
+        offset: int = 0,
+        length: int = None,
+        read_all: bool = None,
+        byte_offset: int = None,
+        byte_length: int = None,
+        decompress: bool = True
+) -> FileResult:
     """
     Read a file from the disk
 
+    Images and binary files larger than max_binary_read_size (from config) are not returned
+    whole, only their first bytes are returned with is_partial set.
+
     :param path: The path to the file
-    :param offset: Offset Starting line number to read from (default: 0)
+    :param offset: Offset Starting line number to read from (default: 0), negative values count back from the end of the file
     :param length: Length Maximum number of lines to read (default: from config or 1000)
     :param read_all: If True, read the entire file, otherwise read from offset to length
+    :param byte_offset: If set (or byte_length is set), read a byte range starting here instead of lines,
+        negative values count back from the end of the file
+    :param byte_length: Maximum number of bytes to read in byte range mode (default: up to the end of the file)
+    :param decompress: If True, gzip, bzip2, xz and zstd files holding text are decompressed while reading,
+        offset and length then apply to the lines of the decompressed content
     :return: FileResult containing the file content, path, mime type, and whether it is an image
     """
+    return _read_file_operation(path, offset, length, read_all, byte_offset, byte_length, decompress).run()
+
+
+async def read_file_from_disk_async(
+        path: str,
+        offset: int = 0,
+        length: int = None,
+        read_all: bool = None,
+        byte_offset: int = None,
+        byte_length: int = None,
+        decompress: bool = True
+) -> FileResult:
+    """
+    Async variant of read_file_from_disk, the event loop is not blocked while reading
+    """
+    return await _read_file_operation(
+        path, offset, length, read_all, byte_offset, byte_length, decompress
+    ).run_async()
+
+
+def _read_file_operation(
+        path: str,
+        offset: int,
+        length: Optional[int],
+        read_all: Optional[bool],
+        byte_offset: Optional[int],
+        byte_length: Optional[int],
+        decompress: bool = True
+) -> DeferredFileOperation:
     if not path:
         raise ValueError("Path is empty")
 
@@ -123,74 +383,203 @@ def read_file_from_disk(path: str, offset: int = 0, length: int = None, read_all
         logging.error(f"Path is not valid: {path}")
         raise ValueError(f"Path is not valid: {path}")
 
+    def prepare_read() -> FileOperation:
+        return _prepare_read_file(path, offset, length, read_all, byte_offset, byte_length, decompress)
+
+    return DeferredFileOperation(prepare_read, FILE_READ_TIMEOUT)
+
+
+def _prepare_read_file(
+        path: str,
+        offset: int,
+        length: Optional[int],
+        read_all: Optional[bool],
+        byte_offset: Optional[int],
+        byte_length: Optional[int],
+        decompress: bool
+) -> FileOperation:
+    """
+    Check and sniff a file to read, the path is normalized and valid
+    """
     if not os.path.exists(path):
         logging.error(f"Path does not exist: {path}")
         raise FileNotFoundError(f"Path does not exist: {path}")
 
-    if offset < 0:
-        raise ValueError("Offset must be greater than or equal to 0")
+    if byte_length is not None and byte_length < 0:
+        raise ValueError("Byte length must be greater than or equal to 0")
+    byte_range = byte_offset is not None or byte_length is not None
 
+    config = get_config_manager()
     if length is None and read_all is None:
-        config = get_config_manager()
         length = config.config.get("max_read_length", 1000)
+    max_binary_size = config.config.get("max_binary_read_size", 10 * 1024 * 1024)
 
     mime_type = get_mime_type(path)
     is_image = is_image_file(mime_type)
+    sniffed = None
+    if is_text_type(mime_type):
+        # Sniff the first bytes so binary files skip the text decoding entirely
+        sniffed = sniff_content(path)
+        if sniffed.is_binary:
+            mime_type = 'application/octet-stream'
+    file_mime_type = mime_type
+    compression = COMPRESSION_FORMATS.get(mime_type)
+    if compression and not byte_range and decompress and decompression_available(compression):
+        sniffed = sniff_compressed(path, compression)
+        if sniffed.is_binary:
+            # A compressed binary payload is returned as is
+            compression = None
+        else:
+            mime_type = inner_mime_type(path)
+    else:
+        compression = None
+    # Images, archives, PDFs etc. are never decoded as text
+    is_binary = sniffed is None or sniffed.is_binary
+
+    def read_bytes(start: Optional[int], limit: Optional[int], decode: bool) -> FileResult:
+        if limit is None or limit > max_binary_size:
+            limit = max_binary_size
+        with map_file(path) as data:
+            size = len(data)
+            start, end = resolve_byte_range(size, start, limit)
+            with memoryview(data) as view, view[start:end] as selected:
+                content, encoding = None, "base64"
+                if decode:
+                    try:
+                        content, encoding = str(selected, 'utf-8'), "utf-8"
+                    except UnicodeDecodeError:
+                        pass
+                if content is None:
+                    content = encode_base64(selected)
+        return FileResult(
+            file_content=content,
+            file_path=path,
+            mini_type=mime_type,
+            is_image=is_image,
+            encoding=encoding,
+            file_size=size,
+            byte_offset=start,
+            byte_length=end - start,
+            is_partial=end - start < size
+        )
 
-    #TODO: 可以使用配置文件
-    FILE_READ_TIMEOUT = 10  # seconds
-    def read_operation() -> str:
+    def text_result(content: str) -> FileResult:
+        return FileResult(
+            file_content=content,
+            file_path=path,
+            mini_type=mime_type,
+            is_image=is_image,
+            compression=compression
+        )
+
+    def read_operation() -> FileResult:
+        nonlocal mime_type, compression
         try:
-            if is_image:
-                # For images, we read full content and encode it in base64
-                with open(path, 'rb') as f:
-                    content = f.read()
-                return base64.b64encode(content).decode('utf-8')
+            if byte_range:
+                return read_bytes(byte_offset, byte_length, decode=not is_binary)
+            if is_binary:
+                # For images and binary files, we encode the content in base64
+                return read_bytes(0, None, decode=False)
             else:
                 try:
-                    with open(path, 'r', encoding='utf-8') as f:
+                    if compression:
+                        # offset and length apply to the decompressed lines
                         if read_all:
-                            content = f.read()
+                            return text_result(read_compressed_all(path, compression, sniffed.encoding))
+                        return text_result(read_compressed_lines(path, compression, offset, length, sniffed.encoding))
+                    if read_all:
+                        with open(path, 'r', encoding=sniffed.encoding) as f:
+                            return text_result(f.read())
+                    if sniffed.encoding != 'utf-8':
+                        with open(path, 'r', encoding=sniffed.encoding) as f:
+                            return text_result(read_text_lines(f, offset, length))
+                    with open(path, 'rb') as f:
+                        if offset < 0:
+                            # Tail mode, count lines back from the end of the file
+                            content = read_tail_lines(f, -offset, length).decode('utf-8')
                         else:
-                            lines = f.readlines()
-                            if offset >= len(lines):
-                                return ""
-                            end_ind = min(offset + length, len(lines))
-                            selected_lines = lines[offset:end_ind]
-                            content = ''.join(selected_lines)
-                        return content
+                            index = get_line_index(path, file_identity(path, os.fstat(f.fileno())))
+                            content = read_lines(f, index, offset, length).decode('utf-8')
+                    # Match the newline translation of text mode
+                    return text_result(content.replace('\r\n', '\n'))
                 except UnicodeDecodeError:
-                    # If the file is not a text file, read it as binary
+                    # The sniffed sample was text but the rest of the file is not, read it as binary
                     # Ignore offset and length
-                    with open(path, 'rb') as f:
-                        content = f.read()
-                    return base64.b64encode(content).decode('utf-8')
+                    if compression:
+                        # Return the compressed file itself
+                        mime_type, compression = file_mime_type, None
+                    return read_bytes(0, None, decode=False)
         except Exception as e:
             logging.error(f"Error reading file {path}: {e}")
             raise e
 
-    executed_content = execute_with_timeout(read_operation, timeout=FILE_READ_TIMEOUT, default_value="")
+    return FileOperation(read_operation, FILE_READ_TIMEOUT, default_value=text_result(""))
 
-    return FileResult(
-        file_content=executed_content,
-        file_path=path,
-        mini_type=mime_type,
-        is_image=is_image
-    )
 
+def read_file(
+        path: str,
+        offset: int = 0,
+        length: int = None,
+        read_all: bool = None,
+        byte_offset: int = None,
+        byte_length: int = None,
+        decompress: bool = True
+) -> FileResult:
+    return read_file_from_disk(path, offset, length, read_all, byte_offset, byte_length, decompress)
 
-def read_file(path: str, offset: int = 0, length: int = None, read_all: bool = None) -> FileResult:
-    return read_file_from_disk(path, offset, length, read_all)
-    
 
-def write_file(path: str, content: str,  mode: Literal["rewrite", "append"] = 'rewrite') -> None:
+async def read_file_async(
+        path: str,
+        offset: int = 0,
+        length: int = None,
+        read_all: bool = None,
+        byte_offset: int = None,
+        byte_length: int = None,
+        decompress: bool = True
+) -> FileResult:
+    return await read_file_from_disk_async(path, offset, length, read_all, byte_offset, byte_length, decompress)
+
+
+def write_file(
+        path: str,
+        content: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        atomic: bool = None
+) -> None:
     """
     Write content to a file
 
+    Rewrites are atomic by default: the content is written to a temporary file in the same
+    directory and renamed over the target, so readers never see a partially written file.
+    The fsync_policy configuration value ('none', 'file' or 'group') decides how the write
+    is made durable, under 'group' the directory syncs of a batch are shared.
+
     :param path: The path to the file
     :param content: The content to write to the file
     :param mode: The mode to write the file, either 'rewrite' or 'append'
+    :param atomic: Whether a rewrite replaces the file atomically (default: from config or True), appends are always in place
+    """
+    _write_file_operation(path, content, mode, atomic).run()
+
+
+async def write_file_async(
+        path: str,
+        content: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        atomic: bool = None
+) -> None:
+    """
+    Async variant of write_file
     """
+    await _write_file_operation(path, content, mode, atomic).run_async()
+
+
+def _write_file_operation(
+        path: str,
+        content: str,
+        mode: Literal["rewrite", "append"],
+        atomic: Optional[bool] = None
+) -> FileOperation:
     if not path:
         raise ValueError("Path is empty")
 
@@ -199,31 +588,214 @@ def write_file(path: str, content: str,  mode: Literal["rewrite", "append"] = 'r
         logging.error(f"Path is not valid: {path}")
         raise ValueError(f"Path is not valid: {path}")
 
-    write_mode = 'w' if mode == 'rewrite' else 'a'
+    config = get_config_manager()
+    if atomic is None:
+        atomic = config.get_value("atomic_write") is not False
+    fsync_policy = get_fsync_policy()
 
-    FILE_WRITE_TIMEOUT = 30  # seconds
     def write_operation() -> None:
         try:
-            with open(path, write_mode, encoding='utf-8') as f:
-                f.write(content)
+            if mode == 'rewrite' and atomic:
+                with AtomicFile(path, fsync_policy) as target:
+                    # Same newline translation as open(path, 'w')
+                    f = io.TextIOWrapper(target.file, encoding='utf-8')
+                    f.write(content)
+                    f.flush()
+                    f.detach()
+            else:
+                with open(path, 'w' if mode == 'rewrite' else 'a', encoding='utf-8') as f:
+                    f.write(content)
+                    if fsync_policy != "none":
+                        f.flush()
+                        fsync_file(f.fileno())
+            publish_change(path)
         except Exception as e:
             logging.error(f"Error writing file {path}: {e}")
             raise e
 
-    execute_with_timeout(
-        write_operation,
-        timeout=FILE_WRITE_TIMEOUT,
-        default_value=None
-    )
+    return FileOperation(write_operation, FILE_WRITE_TIMEOUT)
+
+
+def open_upload(
+        path: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        encoding: Literal["utf-8", "base64"] = 'utf-8'
+) -> dict:
+    """
+    Start writing a file in chunks, the chunks go to a temporary file that replaces the
+    target atomically on commit, so large payloads never have to be held in memory at once
+
+    :param path: The path to the file
+    :param mode: 'rewrite' to replace the file, 'append' to add the chunks to its current content
+    :param encoding: How the chunks are encoded, 'utf-8' for text or 'base64' for binary data
+    :return: Dict with upload_id, path and the current size of the upload
+    """
+    return _open_upload_operation(path, mode, encoding).run()
+
+
+async def open_upload_async(
+        path: str,
+        mode: Literal["rewrite", "append"] = 'rewrite',
+        encoding: Literal["utf-8", "base64"] = 'utf-8'
+) -> dict:
+    """
+    Async variant of open_upload
+    """
+    return await _open_upload_operation(path, mode, encoding).run_async()
+
+
+def _open_upload_operation(path: str, mode: Literal["rewrite", "append"], encoding: str) -> FileOperation:
+    if not path:
+        raise ValueError("Path is empty")
+    path = normalize_path(path)
+    if not is_path_valid(path):
+        logging.error(f"Path is not valid: {path}")
+        raise ValueError(f"Path is not valid: {path}")
+    if mode not in ('rewrite', 'append'):
+        raise ValueError(f"Invalid mode: {mode}")
+    if encoding not in ('utf-8', 'base64'):
+        raise ValueError(f"Invalid encoding: {encoding}")
+    fsync_policy = get_fsync_policy()
+
+    def open_operation() -> dict:
+        try:
+            session = upload_manager.open(path, mode == 'append', encoding, fsync_policy)
+        except Exception as e:
+            logging.error(f"Error opening upload to {path}: {e}")
+            raise e
+        return {'upload_id': session.upload_id, 'path': path, 'size': session.size}
+
+    return FileOperation(open_operation, FILE_WRITE_TIMEOUT)
+
+
+def write_upload_chunk(upload_id: str, sequence: int, content: str) -> dict:
+    """
+    Write the next chunk of an upload
+
+    :param upload_id: The id returned by open_upload
+    :param sequence: The 0-based number of the chunk, resending a chunk that was already written is a no-op
+    :param content: The chunk, encoded as given to open_upload
+    :return: Dict with upload_id, the next expected sequence and the size written so far
+    """
+    return _write_upload_chunk_operation(upload_id, sequence, content).run()
+
+
+async def write_upload_chunk_async(upload_id: str, sequence: int, content: str) -> dict:
+    """
+    Async variant of write_upload_chunk
+    """
+    return await _write_upload_chunk_operation(upload_id, sequence, content).run_async()
+
+
+def _write_upload_chunk_operation(upload_id: str, sequence: int, content: str) -> FileOperation:
+    if sequence < 0:
+        raise ValueError("Sequence must not be negative")
+
+    def write_chunk_operation() -> dict:
+        # Chunks are decoded on the worker, they may be large
+        session = upload_manager.get(upload_id)
+        try:
+            data = binascii.a2b_base64(content) if session.encoding == 'base64' else content.encode('utf-8')
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 chunk: {e}")
+        try:
+            written = upload_manager.write(upload_id, sequence, data)
+        except Exception as e:
+            logging.error(f"Error writing chunk {sequence} of upload {upload_id}: {e}")
+            raise e
+        return {'upload_id': upload_id, 'next_sequence': written.next_sequence, 'size': written.size}
+
+    return FileOperation(write_chunk_operation, FILE_WRITE_TIMEOUT)
 
 
-def move_file(src: str, dest: str) -> None:
+def commit_upload(upload_id: str) -> dict:
     """
-    Move a file from src to dest, if the destination exists, it will be overwritten
+    Finish an upload, the target file is atomically replaced with the uploaded content
 
-    :param src: The source path of the file
-    :param dest: The destination path of the file
+    :param upload_id: The id returned by open_upload
+    :return: Dict with path, size and the number of chunks written
     """
+    return _commit_upload_operation(upload_id).run()
+
+
+async def commit_upload_async(upload_id: str) -> dict:
+    """
+    Async variant of commit_upload
+    """
+    return await _commit_upload_operation(upload_id).run_async()
+
+
+def _commit_upload_operation(upload_id: str) -> FileOperation:
+    upload_manager.get(upload_id)
+
+    def commit_operation() -> dict:
+        try:
+            # Leave time for the rename and fsync within the timeout
+            session = upload_manager.commit(upload_id, wait=FILE_WRITE_TIMEOUT / 2)
+            publish_change(session.path)
+        except Exception as e:
+            logging.error(f"Error committing upload {upload_id}: {e}")
+            raise e
+        return {'path': session.path, 'size': session.size, 'chunks': session.next_sequence}
+
+    return FileOperation(commit_operation, FILE_WRITE_TIMEOUT)
+
+
+def abort_upload(upload_id: str) -> None:
+    """
+    Discard an upload, the target file is left untouched
+
+    :param upload_id: The id returned by open_upload
+    """
+    _abort_upload_operation(upload_id).run()
+
+
+async def abort_upload_async(upload_id: str) -> None:
+    """
+    Async variant of abort_upload
+    """
+    await _abort_upload_operation(upload_id).run_async()
+
+
+def _abort_upload_operation(upload_id: str) -> FileOperation:
+    upload_manager.get(upload_id)
+
+    def abort_operation() -> None:
+        try:
+            upload_manager.abort(upload_id)
+        except Exception as e:
+            logging.error(f"Error aborting upload {upload_id}: {e}")
+            raise e
+
+    return FileOperation(abort_operation, FILE_DELETE_TIMEOUT)
+
+
+def move_file(src: str, dest: str, progress: Callable[[float, Optional[float]], None] = None) -> None:
+    """
+    Move a file or a directory tree from src to dest, if the destination is a file, it will be overwritten
+
+    Moves across file systems copy the data with copy_file_range/sendfile (the files of a
+    tree in parallel) to a temporary path next to dest, rename it into place and then remove src.
+
+    :param src: The source path of the file or directory
+    :param dest: The destination path of the file or directory
+    :param progress: Optional callback called with the bytes copied so far and the total, when the data is copied
+    """
+    _move_file_operation(src, dest, progress).run()
+
+
+async def move_file_async(src: str, dest: str, progress: Callable[[float, Optional[float]], None] = None) -> None:
+    """
+    Async variant of move_file
+    """
+    await _move_file_operation(src, dest, progress).run_async()
+
+
+def _move_file_operation(
+        src: str,
+        dest: str,
+        progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> DeferredFileOperation:
     if not src or not dest:
         raise ValueError("Source or destination path is empty")
 
@@ -232,29 +804,50 @@ def move_file(src: str, dest: str) -> None:
     if not is_path_valid(src) or not is_path_valid(dest):
         logging.error(f"Source or destination path is not valid: {src} -> {dest}")
         raise ValueError(f"Source or destination path is not valid: {src} -> {dest}")
+    if dest.startswith(src + os.sep):
+        raise ValueError(f"Cannot move {src} into itself: {dest}")
 
-    if not os.path.exists(src):
+    def prepare_move() -> FileOperation:
+        return _prepare_move_file(src, dest, progress)
+
+    return DeferredFileOperation(prepare_move, FILE_MOVE_TIMEOUT)
+
+
+def _prepare_move_file(
+        src: str,
+        dest: str,
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> FileOperation:
+    """
+    Check the source of a move and pick its timeout, the paths are normalized and valid
+    """
+    if not os.path.lexists(src):
         logging.error(f"Source path does not exist: {src}")
         raise FileNotFoundError(f"Source path does not exist: {src}")
 
+    # Copying to another file system takes as long as the data needs, not a fixed time
+    timeout = FILE_MOVE_TIMEOUT if is_same_device(src, dest) else FILE_CROSS_DEVICE_MOVE_TIMEOUT
+
     def move_operation() -> None:
         try:
             dest_dir = os.path.dirname(dest)
-            if dest_dir and not os.path.exists(dest_dir):
+            if dest_dir and not directory_exists(dest_dir):
                 os.makedirs(dest_dir, exist_ok=True)
 
-            os.rename(src, dest)
+            try:
+                os.rename(src, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise e
+                move_across_devices(src, dest, progress)
+            publish_change(src)
+            publish_change(dest)
 
         except Exception as e:
             logging.error(f"Error moving file from {src} to {dest}: {e}")
             raise e
 
-    FILE_MOVE_TIMEOUT = 30  # seconds
-    execute_with_timeout(
-        move_operation,
-        timeout=FILE_MOVE_TIMEOUT,
-        default_value=None
-    )
+    return FileOperation(move_operation, timeout)
 
 
 def delete_file(path: str) -> None:
@@ -263,6 +856,17 @@ def delete_file(path: str) -> None:
 
     :param path: The path to the file
     """
+    _delete_file_operation(path).run()
+
+
+async def delete_file_async(path: str) -> None:
+    """
+    Async variant of delete_file
+    """
+    await _delete_file_operation(path).run_async()
+
+
+def _delete_file_operation(path: str) -> FileOperation:
     if not path:
         raise ValueError("Path is empty")
     path = normalize_path(path)
@@ -275,59 +879,154 @@ def delete_file(path: str) -> None:
     def delete_operation() -> None:
         try:
             os.remove(path)
+            publish_change(path)
         except Exception as e:
             logging.error(f"Error deleting file {path}: {e}")
             raise e
-    FILE_DELETE_TIMEOUT = 10  # seconds
-    execute_with_timeout(
-        delete_operation,
-        timeout=FILE_DELETE_TIMEOUT,
-        default_value=None
-    )
+    return FileOperation(delete_operation, FILE_DELETE_TIMEOUT)
 
 
-def list_files(path: str) -> list:
+def describe_entry(entry: os.DirEntry) -> dict:
+    """
+    Build the file information of a directory entry, reusing the stat data cached on the entry
+
+    :param entry: The entry returned by os.scandir
+    :return: Dict with name, path, is_directory, size and modified
+    """
+    try:
+        item_stat = entry.stat()
+        is_directory = entry.is_dir()
+    except OSError:
+        # Broken symlink, describe the link itself
+        item_stat = entry.stat(follow_symlinks=False)
+        is_directory = False
+    return {
+        'name': entry.name,
+        'path': entry.path,
+        'is_directory': is_directory,
+        'size': item_stat.st_size,
+        'modified': item_stat.st_mtime
+    }
+
+
+def list_files(
+        path: str,
+        limit: int = None,
+        cursor: str = None,
+        pattern: str = None,
+        sort_by: Literal["name", "size", "modified"] = None,
+        reverse: bool = False
+) -> list:
     """
     List files in a directory
 
+    Large directories can be paged by passing the name of the last item of the previous
+    page as the cursor, with the same pattern and sort options. Pages are in name order
+    unless sorted otherwise, so paging continues even if the cursor item was deleted.
+
     :param path: The directory path to list.
+    :param limit: Maximum number of items to return (default: all).
+    :param cursor: Name of the item to continue after.
+    :param pattern: Glob pattern the item names must match, e.g. '*.csv'.
+    :param sort_by: Sort by 'name', 'size' or 'modified' (default: directory order, name order when paging).
+    :param reverse: Sort in descending order.
     :return: List of file and directory information
     """
+    return _list_files_operation(path, limit, cursor, pattern, sort_by, reverse).run()
+
+
+async def list_files_async(
+        path: str,
+        limit: int = None,
+        cursor: str = None,
+        pattern: str = None,
+        sort_by: Literal["name", "size", "modified"] = None,
+        reverse: bool = False
+) -> list:
+    """
+    Async variant of list_files
+    """
+    return await _list_files_operation(path, limit, cursor, pattern, sort_by, reverse).run_async()
+
+
+def _list_files_operation(
+        path: str,
+        limit: Optional[int],
+        cursor: Optional[str],
+        pattern: Optional[str],
+        sort_by: Optional[str],
+        reverse: bool
+) -> FileOperation:
     if not path:
         raise ValueError("Path is empty")
     path = normalize_path(path)
     if not is_path_valid(path):
         logging.error(f"Path is not valid: {path}")
         raise ValueError(f"Path is not valid: {path}")
-    if not os.path.exists(path):
-        logging.error(f"Path does not exist: {path}")
-        raise FileNotFoundError(f"Path does not exist: {path}")
-    if not os.path.isdir(path):
+    if not directory_exists(path):
+        if not os.path.exists(path):
+            logging.error(f"Path does not exist: {path}")
+            raise FileNotFoundError(f"Path does not exist: {path}")
         raise ValueError(f"Path is not a directory: {path}")
+    if limit is not None and limit <= 0:
+        raise ValueError("Limit must be greater than 0")
+    if sort_by not in (None, "name", "size", "modified"):
+        raise ValueError(f"Invalid sort key: {sort_by}")
+    if cursor is not None and (not cursor or os.sep in cursor or cursor in (os.curdir, os.pardir)):
+        raise ValueError(f"Cursor must be an item name: {cursor}")
+
+    def list_by_name(entries: Iterator[os.DirEntry]) -> list:
+        if cursor is not None:
+            entries = (e for e in entries if (e.name < cursor if reverse else e.name > cursor))
+        # Only the selected entries are stat-ed
+        if limit is None:
+            selected = sorted(entries, key=lambda e: e.name, reverse=reverse)
+        elif reverse:
+            selected = heapq.nlargest(limit, entries, key=lambda e: e.name)
+        else:
+            selected = heapq.nsmallest(limit, entries, key=lambda e: e.name)
+        return [describe_entry(e) for e in selected]
+
+    def list_by_stat(entries: Iterator[os.DirEntry]) -> list:
+        def sort_key(item: dict) -> tuple:
+            return item[sort_by], item['name']
+
+        items = (describe_entry(e) for e in entries)
+        if cursor is not None:
+            cursor_path = os.path.join(path, cursor)
+            try:
+                cursor_stat = os.stat(cursor_path) if os.path.exists(cursor_path) else os.lstat(cursor_path)
+            except OSError:
+                # Its size or modification time was the position in the listing
+                raise ValueError(
+                    f"Cursor item no longer exists: {cursor}, list again without a cursor or page with sort_by='name'"
+                )
+            cursor_value = cursor_stat.st_size if sort_by == "size" else cursor_stat.st_mtime
+            cursor_key = cursor_value, cursor
+            items = (i for i in items if (sort_key(i) < cursor_key if reverse else sort_key(i) > cursor_key))
+        if limit is None:
+            return sorted(items, key=sort_key, reverse=reverse)
+        if reverse:
+            return heapq.nlargest(limit, items, key=sort_key)
+        return heapq.nsmallest(limit, items, key=sort_key)
+
     def list_operation():
         try:
-            items = []
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                item_stat = os.stat(item_path)
-                items.append({
-                    'name': item,
-                    'path': item_path,
-                    'is_directory': os.path.isdir(item_path),
-                    'size': item_stat.st_size,
-                    'modified': item_stat.st_mtime
-                })
-            return items
+            with os.scandir(path) as it:
+                entries = it
+                if pattern:
+                    entries = (e for e in it if fnmatch.fnmatch(e.name, pattern))
+                if sort_by is None and limit is None and cursor is None:
+                    return [describe_entry(e) for e in entries]
+                # Pages are in name order, so the cursor does not need to exist any more
+                if sort_by in (None, "name"):
+                    return list_by_name(entries)
+                return list_by_stat(entries)
         except Exception as e:
             logging.error(f"Error listing directory {path}: {e}")
             raise e
 
-    FILE_LIST_TIMEOUT = 10  # seconds
-    return execute_with_timeout(
-        list_operation,
-        timeout=FILE_LIST_TIMEOUT,
-        default_value=[]
-    )
+    return FileOperation(list_operation, FILE_LIST_TIMEOUT, default_value=[])
 
 
 def create_directory(path: str) -> None:
@@ -336,6 +1035,17 @@ def create_directory(path: str) -> None:
 
     :param path: The directory path to create
     """
+    _create_directory_operation(path).run()
+
+
+async def create_directory_async(path: str) -> None:
+    """
+    Async variant of create_directory
+    """
+    await _create_directory_operation(path).run_async()
+
+
+def _create_directory_operation(path: str) -> FileOperation:
     if not path:
         raise ValueError("Path is empty")
     path = normalize_path(path)
@@ -346,14 +1056,959 @@ def create_directory(path: str) -> None:
     def create_operation():
         try:
             os.makedirs(path, exist_ok=True)
+            _existing_dirs.add(path)
         except Exception as e:
             logging.error(f"Error creating directory {path}: {e}")
             raise e
 
-    FILE_CREATE_TIMEOUT = 10  # seconds
-    execute_with_timeout(
-        create_operation,
-        timeout=FILE_CREATE_TIMEOUT,
-        default_value=None
-    )
+    return FileOperation(create_operation, FILE_CREATE_TIMEOUT)
+
+
+def matches_any(relative_path: str, patterns: Optional[List[str]]) -> bool:
+    """
+    Check if a path relative to the walk root, or its last component, matches any glob pattern
+    """
+    if not patterns:
+        return False
+    name = os.path.basename(relative_path)
+    return any(fnmatch.fnmatch(relative_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def iter_walk(
+        root: str,
+        max_depth: Optional[int] = None,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        chunk_size: int = WALK_CHUNK_SIZE
+) -> Iterator[List[dict]]:
+    """
+    Walk a directory tree, scanning directories in parallel on the parallel pool
+
+    Excluded directories are not descended into, symlinked directories are not followed.
+    Stopping the iteration cancels the directories that are still queued.
+
+    :param root: The normalized, validated root directory
+    :param max_depth: Maximum depth to descend, 1 only lists the root itself (default: unlimited)
+    :param include: Glob patterns the returned entries must match (default: all)
+    :param exclude: Glob patterns of entries to skip and directories to prune
+    :param chunk_size: Number of entries per yielded chunk
+    :return: Iterator over chunks of file information, see describe_entry, with relative_path and depth
+    """
+    pool = get_parallel_pool()
+
+    def scan(directory: str, depth: int) -> Tuple[list, list]:
+        selected, subdirs = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    relative_path = os.path.relpath(entry.path, root)
+                    if matches_any(relative_path, exclude):
+                        continue
+                    if entry.is_dir(follow_symlinks=False) and (max_depth is None or depth < max_depth):
+                        subdirs.append(entry.path)
+                    if not include or matches_any(relative_path, include):
+                        try:
+                            item = describe_entry(entry)
+                        except OSError:
+                            # Removed while walking
+                            continue
+                        item['relative_path'] = relative_path
+                        item['depth'] = depth
+                        selected.append(item)
+        except OSError as e:
+            logging.warning(f"Skipping directory {directory}: {e}")
+        return selected, subdirs
+
+    pending = {pool.submit_or_run(scan, root, 1): 1}
+    chunk = []
+    try:
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                depth = pending.pop(future)
+                selected, subdirs = future.result()
+                for subdir in subdirs:
+                    pending[pool.submit_or_run(scan, subdir, depth + 1)] = depth + 1
+                chunk.extend(selected)
+                while len(chunk) >= chunk_size:
+                    yield chunk[:chunk_size]
+                    chunk = chunk[chunk_size:]
+        if chunk:
+            yield chunk
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def walk_files(
+        path: str,
+        max_depth: int = None,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Recursively list a directory tree
+
+    :param path: The root directory to walk.
+    :param max_depth: Maximum depth to descend, 1 only lists the root itself (default: unlimited).
+    :param include: Glob patterns the returned entries must match, e.g. ['*.py'] (default: all).
+    :param exclude: Glob patterns of entries to skip and directories not to descend into, e.g. ['.git'].
+    :param max_results: Maximum number of entries to return (default: from config or 10000).
+    :param progress: Optional callback called with the number of entries found after each chunk.
+    :return: A dict consist of follow k-v:
+        - root (str): The normalized root directory.
+        - entries (list): File information of each entry, with relative_path and depth.
+        - truncated (bool): Whether the walk stopped early because of max_results or the time limit.
+    """
+    return _walk_files_operation(path, max_depth, include, exclude, max_results, progress).run()
+
+
+async def walk_files_async(
+        path: str,
+        max_depth: int = None,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Async variant of walk_files
+    """
+    return await _walk_files_operation(path, max_depth, include, exclude, max_results, progress).run_async()
+
+
+def _walk_files_operation(
+        path: str,
+        max_depth: Optional[int],
+        include: Optional[List[str]],
+        exclude: Optional[List[str]],
+        max_results: Optional[int],
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> FileOperation:
+    if not path:
+        raise ValueError("Path is empty")
+    path = normalize_path(path)
+    if not is_path_valid(path):
+        logging.error(f"Path is not valid: {path}")
+        raise ValueError(f"Path is not valid: {path}")
+    if not directory_exists(path):
+        if not os.path.exists(path):
+            logging.error(f"Path does not exist: {path}")
+            raise FileNotFoundError(f"Path does not exist: {path}")
+        raise ValueError(f"Path is not a directory: {path}")
+    if max_depth is not None and max_depth <= 0:
+        raise ValueError("Max depth must be greater than 0")
+    if max_results is None:
+        config = get_config_manager()
+        max_results = config.config.get("max_walk_results", 10000)
+
+    def walk_operation() -> dict:
+        deadline = soft_deadline(FILE_WALK_TIMEOUT)
+        entries = []
+        truncated = False
+        try:
+            for chunk in iter_walk(path, max_depth, include, exclude):
+                entries.extend(chunk[:max_results - len(entries)])
+                if len(entries) >= max_results:
+                    truncated = True
+                if progress:
+                    progress(len(entries), None)
+                if truncated or time.monotonic() > deadline:
+                    truncated = True
+                    break
+        except Exception as e:
+            logging.error(f"Error walking directory {path}: {e}")
+            raise e
+        return {
+            'root': path,
+            'entries': entries,
+            'truncated': truncated
+        }
+
+    return FileOperation(walk_operation, FILE_WALK_TIMEOUT)
+
+
+def search_file(
+        path: str,
+        regex: re.Pattern,
+        max_matches: int,
+        stop: threading.Event,
+        literal: Optional[bytes] = None
+) -> List[dict]:
+    """
+    Search a file for a compiled bytes regex, matching directly against the mapped file
+
+    Like grep, matches are confined to single lines and each matching line is reported once.
+    The regex should be compiled with re.MULTILINE so ^ and $ match at line boundaries.
+
+    The re module holds the GIL while it matches, so a literal every match contains (see
+    required_literals) is looked up first and the regex only runs on the lines holding it.
+
+    :param path: The path to the file
+    :param regex: The compiled bytes pattern
+    :param max_matches: Maximum number of matches to return
+    :param stop: Event that ends the search early when set
+    :param literal: Optional bytes every match contains, as they appear in the file
+    :return: List of dicts with path, line (0-based, usable as read_file offset) and text
+    """
+    matches = []
+    with map_file(path) as data:
+        line = 0
+        last = 0
+        pos = 0
+        while pos < len(data) and not stop.is_set() and len(matches) < max_matches:
+            if literal:
+                found = data.find(literal, pos)
+                if found == -1:
+                    break
+                line_start = data.rfind(b'\n', 0, found) + 1
+                line_end = data.find(b'\n', found)
+                if line_end == -1:
+                    line_end = len(data)
+                pos = line_end + 1
+                # A match contains the literal and does not span lines, so it is on this line
+                if regex.search(data, line_start, line_end) is None:
+                    continue
+            else:
+                match = regex.search(data, pos)
+                if match is None:
+                    break
+                start = match.start()
+                line_start = data.rfind(b'\n', 0, start) + 1
+                line_end = data.find(b'\n', start)
+                if line_end == -1:
+                    line_end = len(data)
+                pos = line_end + 1
+                if match.end() > line_end:
+                    # The match runs into the next lines (e.g. through \s or [^x]), match this line alone
+                    if regex.search(data, line_start, line_end) is None:
+                        continue
+            line += count_newlines(data, last, line_start)
+            last = line_start
+            matches.append({
+                'path': path,
+                'line': line,
+                'text': data[line_start:min(line_end, line_start + SEARCH_MAX_LINE_LENGTH)]
+                .decode('utf-8', errors='replace').rstrip('\r')
+            })
+    return matches
+
+
+def search_files(
+        path: str,
+        pattern: str,
+        regex: bool = True,
+        case_sensitive: bool = True,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = 100
+) -> dict:
+    """
+    Search the content of a file or of all text files below a directory
+
+    Files are searched in parallel, binary files are skipped and the search stops as soon
+    as max_results matches have been found. The regex itself holds the GIL, so workers
+    mostly overlap reading the files; for case-sensitive patterns with a literal part, the
+    regex only runs on the lines that contain it.
+
+    :param path: The file or directory to search.
+    :param pattern: The regular expression (or literal text if regex is False) to search for.
+    :param regex: Whether the pattern is a regular expression.
+    :param case_sensitive: Whether the search is case sensitive.
+    :param include: Glob patterns of the files to search, e.g. ['*.py'] (default: all).
+    :param exclude: Glob patterns of files to skip and directories not to descend into.
+    :param max_results: Maximum number of matches to return.
+    :return: A dict consist of follow k-v:
+        - matches (list): Dicts with path, line (0-based) and text of each matching line.
+        - files_searched (int): Number of files searched.
+        - truncated (bool): Whether the search stopped early because of max_results or the time limit.
+    """
+    return _search_files_operation(path, pattern, regex, case_sensitive, include, exclude, max_results).run()
+
+
+async def search_files_async(
+        path: str,
+        pattern: str,
+        regex: bool = True,
+        case_sensitive: bool = True,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_results: int = 100
+) -> dict:
+    """
+    Async variant of search_files
+    """
+    return await _search_files_operation(path, pattern, regex, case_sensitive, include, exclude, max_results).run_async()
+
+
+def _search_files_operation(
+        path: str,
+        pattern: str,
+        regex: bool,
+        case_sensitive: bool,
+        include: Optional[List[str]],
+        exclude: Optional[List[str]],
+        max_results: int
+) -> FileOperation:
+    if not path:
+        raise ValueError("Path is empty")
+    if not pattern:
+        raise ValueError("Pattern is empty")
+    path = normalize_path(path)
+    if not is_path_valid(path):
+        logging.error(f"Path is not valid: {path}")
+        raise ValueError(f"Path is not valid: {path}")
+    if not os.path.exists(path):
+        logging.error(f"Path does not exist: {path}")
+        raise FileNotFoundError(f"Path does not exist: {path}")
+    if max_results <= 0:
+        raise ValueError("Max results must be greater than 0")
+    try:
+        source = pattern.encode('utf-8') if regex else re.escape(pattern.encode('utf-8'))
+        compiled = re.compile(source, re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}")
+    literals = required_literals(pattern.encode('utf-8'), regex)
+    # Case-insensitive matches (also through an inline (?i)) may spell the literal differently
+    literal = max(literals, key=len) if literals and not compiled.flags & re.IGNORECASE else None
+
+    def search_operation() -> dict:
+        deadline = soft_deadline(FILE_SEARCH_TIMEOUT)
+        pool = get_parallel_pool()
+        stop = threading.Event()
+        matches = []
+        files_searched = 0
+        pending = set()
+
+        def search_one(file_path: str) -> Optional[List[dict]]:
+            if stop.is_set() or not is_searchable_text(file_path):
+                return None
+            return search_file(file_path, compiled, max_results, stop, literal)
+
+        def collect(done) -> None:
+            nonlocal files_searched
+            for future in done:
+                try:
+                    found = future.result()
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipping file while searching: {e}")
+                    continue
+                if found is None:
+                    continue
+                files_searched += 1
+                matches.extend(found)
+                if len(matches) >= max_results:
+                    stop.set()
+
+        def candidates() -> Iterator[str]:
+            if not os.path.isdir(path):
+                yield path
+                return
+            index = get_search_index(get_allowed_dirs_matcher().roots)
+            if index is not None and index.covers(path):
+                indexed_literals = literals
+                if not case_sensitive:
+                    # The index only folds ASCII case
+                    indexed_literals = [part for part in literals if part.isascii()]
+                indexed = index.candidates(path, indexed_literals)
+                unindexed = index.unindexed(path) if indexed is not None else None
+                if unindexed is not None:
+
+                    def selected(file_path: str) -> bool:
+                        # The same filters as iter_walk, applied to each directory of the path
+                        relative_path = os.path.relpath(file_path, path)
+                        parts = relative_path.split(os.sep)
+                        if any(matches_any(os.sep.join(parts[:i]), exclude) for i in range(1, len(parts) + 1)):
+                            return False
+                        if include and not matches_any(relative_path, include):
+                            return False
+                        return is_path_allowed(file_path)
+
+                    for file_path in sorted(indexed):
+                        if selected(file_path):
+                            yield file_path
+                    # Excluded trees and symbolic links are not indexed, walk them so the
+                    # results do not depend on the index
+                    for entry_path in sorted(unindexed):
+                        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+                            for chunk in iter_walk(entry_path):
+                                for item in chunk:
+                                    if not item['is_directory'] and selected(item['path']):
+                                        yield item['path']
+                        elif os.path.isfile(entry_path) and selected(entry_path):
+                            yield entry_path
+                    return
+            for chunk in iter_walk(path, None, include, exclude):
+                for item in chunk:
+                    if not item['is_directory'] and is_path_allowed(item['path']):
+                        yield item['path']
+
+        try:
+            for file_path in candidates():
+                if stop.is_set() or time.monotonic() > deadline:
+                    stop.set()
+                    break
+                pending.add(pool.submit_or_run(search_one, file_path))
+                # Bound the number of queued files so early termination stays cheap
+                if len(pending) >= 2 * pool.max_workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(done)
+            if stop.is_set():
+                for future in pending:
+                    future.cancel()
+            done, not_done = concurrent.futures.wait(pending, timeout=max(deadline - time.monotonic(), 0))
+            collect(f for f in done if not f.cancelled())
+            if not_done:
+                stop.set()
+        except Exception as e:
+            logging.error(f"Error searching {path}: {e}")
+            raise e
+        matches.sort(key=lambda m: (m['path'], m['line']))
+        return {
+            'matches': matches[:max_results],
+            'files_searched': files_searched,
+            'truncated': stop.is_set()
+        }
+
+    return FileOperation(search_operation, FILE_SEARCH_TIMEOUT)
+
+
+
+def _batch_item(item: dict) -> Tuple[str, List[str], Callable[[], Union[FileOperation, DeferredFileOperation]]]:
+    """
+    Parse one operation of a batch
+
+    :param item: The operation, see batch_file_operations
+    :return: The operation name, the paths it touches and a builder of the validated FileOperation
+    """
+    op = item.get('op')
+    if op == 'read':
+        path = item.get('path')
+        return op, [path], lambda: _read_file_operation(
+            path,
+            item.get('offset', 0),
+            item.get('length'),
+            item.get('read_all'),
+            item.get('byte_offset'),
+            item.get('byte_length'),
+            item.get('decompress', True)
+        )
+    if op == 'write':
+        path = item.get('path')
+        return op, [path], lambda: _write_file_operation(
+            path, item.get('content', ''), item.get('mode', 'rewrite'), item.get('atomic')
+        )
+    if op == 'edit':
+        path = item.get('path')
+        return op, [path], lambda: _edit_file_operation(path, item.get('edits'), item.get('diff'))
+    if op == 'move':
+        source, destination = item.get('source'), item.get('destination')
+        return op, [source, destination], lambda: _move_file_operation(source, destination)
+    if op == 'delete':
+        path = item.get('path')
+        return op, [path], lambda: _delete_file_operation(path)
+    if op == 'create_directory':
+        path = item.get('path')
+        return op, [path], lambda: _create_directory_operation(path)
+    raise ValueError(f"Unknown operation: {op}")
+
+
+def _group_by_path(paths: Dict[int, List[str]]) -> List[List[int]]:
+    """
+    Group operations that touch the same path, or a path and one of its ancestors, so
+    each group can run in order while independent groups run concurrently
+
+    :param paths: The normalized paths touched by each operation, by operation index
+    :return: The groups of operation indexes, each in ascending order
+    """
+    parent = {i: i for i in paths}
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(a: int, b: int) -> None:
+        parent[find(a)] = find(b)
+
+    # The first operation touching each path, and the operations touching something below it
+    owners: Dict[str, int] = {}
+    below: Dict[str, List[int]] = {}
+    for i, item_paths in paths.items():
+        for path in item_paths:
+            if path in owners:
+                union(i, owners[path])
+            owners.setdefault(path, i)
+            for j in below.get(path, ()):
+                union(i, j)
+            child, ancestor = path, os.path.dirname(path)
+            while ancestor != child:
+                if ancestor in owners:
+                    union(i, owners[ancestor])
+                below.setdefault(ancestor, []).append(i)
+                child, ancestor = ancestor, os.path.dirname(ancestor)
+
+    groups: Dict[int, List[int]] = {}
+    for i in sorted(paths):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def batch_file_operations(operations: List[dict]) -> List[dict]:
+    """
+    Run many file operations in one call
+
+    Every path is checked against the allowed directories up front. Operations touching
+    the same path (or a directory and something below it) run in the given order, the
+    others run concurrently. Once an operation fails, the later operations on its paths
+    are skipped.
+
+    :param operations: The operations, each a dict with an 'op' key and its arguments:
+        - read: path, offset, length, read_all, byte_offset, byte_length
+        - write: path, content, mode, atomic
+        - edit: path, edits or diff
+        - move: source, destination
+        - delete: path
+        - create_directory: path
+    :return: One result per operation, in order, with index, op, ok and either result or error
+    """
+    return _batch_file_operations_operation(operations).run()
+
+
+async def batch_file_operations_async(operations: List[dict]) -> List[dict]:
+    """
+    Async variant of batch_file_operations
+    """
+    return await _batch_file_operations_operation(operations).run_async()
+
+
+def _batch_file_operations_operation(operations: List[dict]) -> FileOperation:
+    if not operations:
+        raise ValueError("Operations are empty")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"At most {MAX_BATCH_OPERATIONS} operations can run in one batch")
+
+    results: List[Optional[dict]] = [None] * len(operations)
+    names: List[Optional[str]] = [None] * len(operations)
+    builders: Dict[int, Callable[[], Union[FileOperation, DeferredFileOperation]]] = {}
+    paths: Dict[int, List[str]] = {}
+    matcher = get_allowed_dirs_matcher()
+    for i, item in enumerate(operations):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Operation must be an object")
+            names[i] = item.get('op')
+            names[i], item_paths, builders[i] = _batch_item(item)
+            if not all(item_paths):
+                raise ValueError("Path is empty")
+            item_paths = [normalize_path(p) for p in item_paths]
+            for path in item_paths:
+                if not matcher.matches(path):
+                    raise ValueError(f"Path is not valid: {path}")
+            paths[i] = item_paths
+        except ValueError as e:
+            results[i] = {'index': i, 'op': names[i], 'ok': False, 'error': str(e)}
+
+    def batch_operation() -> List[dict]:
+        deadline = soft_deadline(FILE_BATCH_TIMEOUT)
+        pool = get_parallel_pool()
+
+        def run_group(indexes: List[int]) -> None:
+            failed = None
+            for i in indexes:
+                if failed is not None:
+                    error = f"Skipped, operation {failed} on the same path failed"
+                elif time.monotonic() > deadline:
+                    error = f"Timed out after {FILE_BATCH_TIMEOUT} seconds"
+                else:
+                    try:
+                        value = builders[i]().func()
+                        if isinstance(value, FileResult):
+                            value = asdict(value)
+                        results[i] = {'index': i, 'op': names[i], 'ok': True, 'result': value}
+                        continue
+                    except Exception as e:
+                        failed = i
+                        error = str(e)
+                results[i] = {'index': i, 'op': names[i], 'ok': False, 'error': error}
+
+        try:
+            # Under the group fsync policy, the writes of the batch share their directory syncs
+            with write_group():
+                futures = [pool.submit_or_run(run_group, group) for group in _group_by_path(paths)]
+                concurrent.futures.wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            logging.error(f"Error running batch: {e}")
+            raise e
+        return [
+            result if result is not None else {
+                'index': i, 'op': names[i], 'ok': False, 'error': f"Timed out after {FILE_BATCH_TIMEOUT} seconds"
+            }
+            for i, result in enumerate(list(results))
+        ]
+
+    return FileOperation(batch_operation, FILE_BATCH_TIMEOUT)
+
+
+# Digests by algorithm, per file identity
+_digests = FileCache(max_entries=4096)
+add_change_listener(_digests.invalidate)
+
+
+def new_hash(algorithm: str):
+    """
+    Create a hash object for one of HASH_ALGORITHMS, the xxh* algorithms need the xxhash package
+    """
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError(f"Hash algorithm {algorithm} needs the xxhash package")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(path: str, algorithm: str, on_hashed: Callable[[int], None] = None) -> dict:
+    """
+    Hash a file, streaming it from a memory map, unchanged files are served from the digest cache
+
+    :param path: The normalized path to the file
+    :param algorithm: One of HASH_ALGORITHMS
+    :param on_hashed: Optional callback called with the number of bytes hashed by each step
+    :return: Dict with path, size, digest and whether it came from the cache
+    """
+    identity = file_identity(path)
+    digests = _digests.get(path, identity) or {}
+    if algorithm in digests:
+        if on_hashed:
+            on_hashed(identity[1])
+        return {'path': path, 'size': identity[1], 'digest': digests[algorithm], 'cached': True}
+    h = new_hash(algorithm)
+    with map_file(path) as data:
+        if hasattr(data, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(data) as view:
+            for start in range(0, len(view), HASH_CHUNK_SIZE):
+                with view[start:start + HASH_CHUNK_SIZE] as chunk:
+                    # Large updates release the GIL, so files are hashed in parallel
+                    h.update(chunk)
+                    if on_hashed:
+                        on_hashed(len(chunk))
+    digest = h.hexdigest()
+    # Only cache the digest if the file did not change while it was hashed
+    if file_identity(path) == identity:
+        _digests.put(path, identity, {**digests, algorithm: digest})
+    return {'path': path, 'size': identity[1], 'digest': digest, 'cached': False}
+
+
+def hash_files(
+        paths: List[str],
+        algorithm: str = 'sha256',
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Hash files on the server, directories are hashed file by file recursively
+
+    :param paths: The files or directories to hash
+    :param algorithm: One of HASH_ALGORITHMS (xxh* need the xxhash package)
+    :param progress: Optional callback called with the bytes hashed so far and the total
+    :return: Dict with results (path, size, digest, cached, or path and error per file) and truncated
+    """
+    return _hash_files_operation(paths, algorithm, progress).run()
+
+
+async def hash_files_async(
+        paths: List[str],
+        algorithm: str = 'sha256',
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Async variant of hash_files
+    """
+    return await _hash_files_operation(paths, algorithm, progress).run_async()
+
+
+def _hash_files_operation(
+        paths: List[str],
+        algorithm: str,
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> FileOperation:
+    if not paths:
+        raise ValueError("Paths are empty")
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Invalid hash algorithm: {algorithm}, expected one of {', '.join(HASH_ALGORITHMS)}")
+    new_hash(algorithm)
+    normalized = []
+    for path in paths:
+        path = normalize_path(path)
+        if not is_path_valid(path):
+            logging.error(f"Path is not valid: {path}")
+            raise ValueError(f"Path is not valid: {path}")
+        normalized.append(path)
+
+    def hash_operation() -> dict:
+        for path in normalized:
+            if not os.path.exists(path):
+                logging.error(f"Path does not exist: {path}")
+                raise FileNotFoundError(f"Path does not exist: {path}")
+        deadline = soft_deadline(FILE_HASH_TIMEOUT)
+        files = []
+        for path in normalized:
+            if not os.path.isdir(path):
+                files.append((path, os.path.getsize(path)))
+                continue
+            for chunk in iter_walk(path):
+                files.extend(
+                    (item['path'], item['size']) for item in chunk
+                    if not item['is_directory'] and is_path_allowed(item['path'])
+                )
+        total = sum(size for _, size in files)
+        lock = threading.Lock()
+        hashed = 0
+        last_report = 0.0
+
+        def on_hashed(n: int) -> None:
+            nonlocal hashed, last_report
+            with lock:
+                hashed += n
+                now = time.monotonic()
+                if not progress or now - last_report < 0.5:
+                    return
+                last_report = now
+                current = hashed
+            progress(current, total)
+
+        pool = get_parallel_pool()
+        futures = [pool.submit_or_run(hash_file, path, algorithm, on_hashed) for path, _ in files]
+        try:
+            done, not_done = concurrent.futures.wait(futures, timeout=max(deadline - time.monotonic(), 0))
+            for future in not_done:
+                future.cancel()
+        except Exception as e:
+            logging.error(f"Error hashing files: {e}")
+            raise e
+        results = []
+        for (path, _), future in zip(files, futures):
+            if future not in done:
+                continue
+            try:
+                results.append(future.result())
+            except (OSError, ValueError) as e:
+                results.append({'path': path, 'error': str(e)})
+        if progress:
+            progress(hashed, total)
+        return {'algorithm': algorithm, 'results': results, 'truncated': bool(not_done)}
+
+    return FileOperation(hash_operation, FILE_HASH_TIMEOUT)
+
+
+@dataclass
+class LineEdit:
+    """
+    Replace lines [start, end) of a file with new_lines (0-based, end exclusive, start == end inserts)
+    """
+    start: int
+    end: int
+    new_lines: List[str]
+    # The lines that must currently be in the range, checked before replacing them
+    expected: Optional[List[str]] = None
+
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def parse_unified_diff(diff: str) -> List[LineEdit]:
+    """
+    Parse the hunks of a unified diff of a single file into line edits
+
+    :param diff: The diff, file headers (---/+++) are ignored
+    :return: The edits, with the context and removed lines as expected content
+    """
+    edits = []
+    lines = diff.splitlines()
+    i = 0
+    while i < len(lines):
+        match = HUNK_HEADER.match(lines[i])
+        i += 1
+        if not match:
+            continue
+        old_start, old_count = int(match.group(1)), int(match.group(2) or 1)
+        old_lines, new_lines = [], []
+        while i < len(lines) and not lines[i].startswith('@@'):
+            line = lines[i]
+            i += 1
+            if line.startswith('\\'):
+                # "\ No newline at end of file"
+                continue
+            if line.startswith('--- ') or line.startswith('+++ ') or line.startswith('diff '):
+                break
+            tag, text = (line[0], line[1:]) if line else (' ', '')
+            if tag in (' ', '-'):
+                old_lines.append(text)
+            if tag in (' ', '+'):
+                new_lines.append(text)
+            if tag not in (' ', '-', '+'):
+                raise ValueError(f"Invalid line in hunk: {line}")
+        if len(old_lines) != old_count:
+            raise ValueError(f"Hunk at line {old_start} has {len(old_lines)} old lines, the header says {old_count}")
+        # A hunk without old lines inserts after line old_start, otherwise it starts at it (1-based)
+        start = old_start if old_count == 0 else old_start - 1
+        edits.append(LineEdit(start, start + old_count, new_lines, old_lines))
+    if not edits:
+        raise ValueError("Diff has no hunks")
+    return edits
+
+
+def apply_line_edits(src: BinaryIO, dst: BinaryIO, edits: List[LineEdit], encoding: str) -> None:
+    """
+    Stream a file from src to dst, applying sorted, non-overlapping line edits
+
+    Lines outside the edits are copied as is, so their encoding and line endings are
+    kept. Inserted lines use the line ending of the first line of the file. UTF-8 files
+    are streamed as bytes; other encodings (UTF-16 and UTF-32, whose newline is not the
+    byte 0x0a, and UTF-8 with a BOM) are streamed as text so the BOM is only written once.
+
+    :param src: The file to read, at offset 0
+    :param dst: The file to write, at offset 0
+    :param edits: The edits, sorted by start
+    :param encoding: The encoding of the file, used for the new and expected lines
+    """
+    if encoding == 'utf-8':
+        _apply_line_edits(src, dst, edits, lambda data: data.decode(encoding), lambda text: text.encode(encoding))
+        return
+    # newline='' keeps the line endings as they are, both ways
+    text_src = io.TextIOWrapper(src, encoding=encoding, newline='')
+    text_dst = io.TextIOWrapper(dst, encoding=encoding, newline='')
+    try:
+        _apply_line_edits(text_src, text_dst, edits, lambda data: data, lambda text: text)
+        text_dst.flush()
+    finally:
+        # Leave the underlying files open, they are closed by their owners
+        text_src.detach()
+        text_dst.detach()
+
+
+def _apply_line_edits(src, dst, edits: List[LineEdit], decode: Callable, encode: Callable) -> None:
+    """
+    Apply line edits between two files of the same kind, binary or text
+
+    :param decode: Converts a line read from src to str
+    :param encode: Converts a str to what dst is written with
+    """
+    lf, crlf = encode("\n"), encode("\r\n")
+    first = src.readline()
+    newline = crlf if first.endswith(crlf) else lf
+    src.seek(0)
+    line = 0
+    last = None
+    for number, edit in enumerate(edits):
+        while line < edit.start:
+            data = src.readline()
+            if not data:
+                raise ValueError(f"Edit {number} starts at line {edit.start}, past the end of the file ({line} lines)")
+            dst.write(data)
+            last = data
+            line += 1
+        if last and not last.endswith(lf) and edit.new_lines:
+            # Lines inserted after a last line without a newline
+            dst.write(newline)
+            last = newline
+        removed = []
+        while line < edit.end:
+            data = src.readline()
+            if not data:
+                raise ValueError(f"Edit {number} ends at line {edit.end}, past the end of the file ({line} lines)")
+            removed.append(data)
+            line += 1
+        if edit.expected is not None:
+            current = [decode(data).rstrip('\r\n') for data in removed]
+            if current != edit.expected:
+                raise ValueError(f"Edit {number} does not apply, lines {edit.start}-{edit.end} have changed")
+        # Keep a missing newline at the end of the file if the edit replaced the last line,
+        # only the last line of a file can lack one
+        at_end = bool(removed) and not removed[-1].endswith(lf)
+        for k, text in enumerate(edit.new_lines):
+            dst.write(encode(text))
+            if not (at_end and k == len(edit.new_lines) - 1):
+                dst.write(newline)
+    shutil.copyfileobj(src, dst)
+
+
+def edit_file(path: str, edits: List[dict] = None, diff: str = None) -> dict:
+    """
+    Edit a text file in place, either with line-range replacements or with a unified diff
+
+    The file is streamed through to a temporary file that atomically replaces it, so the
+    cost on the wire scales with the edit, not with the file.
+
+    :param path: The path to the file
+    :param edits: Line-range replacements, each a dict with start (0-based line, as read_file offsets),
+        end (exclusive, default: start + 1) and content (the new lines, empty to delete them)
+    :param diff: A unified diff of the file, its context and removed lines must match exactly
+    :return: Dict with path, the number of edits applied and the new size
+    """
+    return _edit_file_operation(path, edits, diff).run()
+
+
+async def edit_file_async(path: str, edits: List[dict] = None, diff: str = None) -> dict:
+    """
+    Async variant of edit_file
+    """
+    return await _edit_file_operation(path, edits, diff).run_async()
+
+
+def _edit_file_operation(path: str, edits: Optional[List[dict]], diff: Optional[str]) -> DeferredFileOperation:
+    if not path:
+        raise ValueError("Path is empty")
+    path = normalize_path(path)
+    if not is_path_valid(path):
+        logging.error(f"Path is not valid: {path}")
+        raise ValueError(f"Path is not valid: {path}")
+    if (edits is None) == (diff is None):
+        raise ValueError("Either edits or diff must be given")
+
+    if diff is not None:
+        line_edits = parse_unified_diff(diff)
+    else:
+        line_edits = []
+        for item in edits:
+            start = item.get('start')
+            end = item.get('end', start + 1 if isinstance(start, int) else None)
+            if not isinstance(start, int) or not isinstance(end, int) or start < 0 or end < start:
+                raise ValueError(f"Invalid line range: {item.get('start')}-{item.get('end')}")
+            line_edits.append(LineEdit(start, end, (item.get('content') or '').splitlines()))
+    line_edits.sort(key=lambda e: (e.start, e.end))
+    for previous, current in zip(line_edits, line_edits[1:]):
+        if previous.end > current.start or (previous.start == current.start and previous.end > previous.start):
+            raise ValueError(f"Edits overlap at line {current.start}")
+
+    def prepare_edit() -> FileOperation:
+        return _prepare_edit_file(path, line_edits)
+
+    return DeferredFileOperation(prepare_edit, FILE_READ_TIMEOUT)
+
+
+def _prepare_edit_file(path: str, line_edits: List[LineEdit]) -> FileOperation:
+    """
+    Check and sniff a file to edit, the path is normalized and valid
+    """
+    if not os.path.isfile(path):
+        logging.error(f"File does not exist: {path}")
+        raise FileNotFoundError(f"File does not exist: {path}")
+    sniffed = sniff_content(path)
+    if sniffed.is_binary:
+        raise ValueError(f"Cannot edit a binary file: {path}")
+    fsync_policy = get_fsync_policy()
+
+    def edit_operation() -> dict:
+        try:
+            with open(path, 'rb', buffering=1024 * 1024) as src, AtomicFile(path, fsync_policy) as target:
+                apply_line_edits(src, target.file, line_edits, sniffed.encoding)
+            publish_change(path)
+        except Exception as e:
+            logging.error(f"Error editing file {path}: {e}")
+            raise e
+        return {'path': path, 'edits': len(line_edits), 'size': os.path.getsize(path)}
 
+    return FileOperation(edit_operation, FILE_EDIT_TIMEOUT)
@@ -1,21 +1,207 @@
-def get_mime_type(file_path: str) -> str:
-    extension = file_path.lower().split('.')[-1] if '.' in file_path else ''
-    
+import codecs
+import os
+import stat
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from server.utils.file_cache import FileCache, file_identity
+from server.utils.fs_watcher import add_change_listener
+
+# Number of leading bytes inspected when sniffing the content of a file
+SNIFF_SIZE = 8192
+
+# Byte order marks, longest first since the UTF-32 LE mark starts with the UTF-16 LE one
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+@dataclass
+class ContentSniff:
+    """
+    Result of sniffing the first bytes of a file
+    """
+    is_binary: bool
+    encoding: Optional[str] = None
+
+
+_sniff_cache = FileCache(max_entries=1024)
+add_change_listener(_sniff_cache.invalidate)
+
+
+# Extension table, used when the content has no recognizable magic number
+EXTENSION_TYPES = {
     # Image types - only the formats we can display
-    image_types = {
-        'png': 'image/png',
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'gif': 'image/gif',
-        'webp': 'image/webp'
-    }
-    
-    # Check if the file is an image
-    if extension in image_types:
-        return image_types[extension]
-    
-    # Default to text/plain for all other files
-    return 'text/plain'
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    # Text types
+    'txt': 'text/plain',
+    'log': 'text/plain',
+    'md': 'text/markdown',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'html': 'text/html',
+    'htm': 'text/html',
+    'css': 'text/css',
+    'js': 'text/javascript',
+    'py': 'text/x-python',
+    'json': 'application/json',
+    'xml': 'application/xml',
+    'yaml': 'application/yaml',
+    'yml': 'application/yaml',
+    'toml': 'application/toml',
+    'sh': 'application/x-sh',
+    # Binary types
+    'pdf': 'application/pdf',
+    'gz': 'application/gzip',
+    'bz2': 'application/x-bzip2',
+    'xz': 'application/x-xz',
+    'zst': 'application/zstd',
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+    '7z': 'application/x-7z-compressed',
+    'parquet': 'application/vnd.apache.parquet',
+    'sqlite': 'application/vnd.sqlite3',
+    'db': 'application/vnd.sqlite3',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'npy': 'application/octet-stream',
+    'bin': 'application/octet-stream',
+}
+
+# Magic numbers as (offset, signature, mime type), checked before the extension
+MAGIC_NUMBERS = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'\x28\xb5\x2f\xfd', 'application/zstd'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (0, b'PAR1', 'application/vnd.apache.parquet'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (0, b'\x7fELF', 'application/x-executable'),
+    (257, b'ustar', 'application/x-tar'),
+)
+MAGIC_READ_SIZE = max(offset + len(signature) for offset, signature, _ in MAGIC_NUMBERS)
+
+# Types outside text/* that are still decoded as text
+TEXT_APPLICATION_TYPES = {
+    'application/json',
+    'application/xml',
+    'application/yaml',
+    'application/toml',
+    'application/x-sh',
+}
+
+
+def get_extension_type(file_path: str) -> Optional[str]:
+    extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+    return EXTENSION_TYPES.get(extension)
+
+
+def detect_magic_type(header: bytes) -> Optional[str]:
+    for offset, signature, mime_type in MAGIC_NUMBERS:
+        if header.startswith(signature, offset):
+            return mime_type
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _detect_mime_type(file_path: str, mtime_ns: int, size: int) -> str:
+    # mtime_ns and size are only part of the cache key, so changed files are detected again
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(MAGIC_READ_SIZE)
+    except OSError:
+        return get_extension_type(file_path) or 'text/plain'
+    mime_type = detect_magic_type(header) or get_extension_type(file_path)
+    if mime_type:
+        return mime_type
+    return 'application/octet-stream' if sniff_content(file_path).is_binary else 'text/plain'
+
+
+def get_mime_type(file_path: str) -> str:
+    """
+    Get the mime type of a file from its magic number, falling back to its extension
+    and then to sniffing its content
+
+    :param file_path: The path to the file
+    :return: The mime type, 'text/plain' for unknown files that do not exist
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return get_extension_type(file_path) or 'text/plain'
+    if not stat.S_ISREG(st.st_mode):
+        return get_extension_type(file_path) or 'application/octet-stream'
+    return _detect_mime_type(file_path, st.st_mtime_ns, st.st_size)
+
 
 def is_image_file(mime_type: str) -> bool:
-    return mime_type.startswith('image/')
\ No newline at end of file
+    return mime_type.startswith('image/')
+
+
+def is_text_type(mime_type: str) -> bool:
+    return mime_type.startswith('text/') or mime_type in TEXT_APPLICATION_TYPES
+
+
+def detect_content(sample: bytes) -> ContentSniff:
+    """
+    Detect whether a sample of a file is text, and in which encoding
+
+    :param sample: The leading bytes of the file
+    :return: ContentSniff with is_binary set, or the text encoding to decode with
+    """
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return ContentSniff(is_binary=False, encoding=encoding)
+    if b'\x00' in sample:
+        return ContentSniff(is_binary=True)
+    try:
+        # The sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return ContentSniff(is_binary=True)
+    return ContentSniff(is_binary=False, encoding='utf-8')
+
+
+def sniff_content(file_path: str) -> ContentSniff:
+    """
+    Sniff the content of a file, cached per file identity
+
+    :param file_path: The normalized path to the file
+    :return: ContentSniff describing the file
+    """
+    with open(file_path, 'rb') as f:
+        identity = file_identity(file_path, os.fstat(f.fileno()))
+        sniffed = _sniff_cache.get(file_path, identity)
+        if sniffed is None:
+            sniffed = detect_content(f.read(SNIFF_SIZE))
+            _sniff_cache.put(file_path, identity, sniffed)
+    return sniffed
+
+
+def is_searchable_text(file_path: str) -> bool:
+    """
+    Check if a file is UTF-8 text that can be searched as bytes, from its mime type and the sniffed content
+
+    :param file_path: The normalized path to the file
+    :return: True if the file can be searched, False otherwise
+    """
+    if not is_text_type(get_mime_type(file_path)):
+        return False
+    sniffed = sniff_content(file_path)
+    return not sniffed.is_binary and sniffed.encoding in ('utf-8', 'utf-8-sig')
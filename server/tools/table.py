@@ -0,0 +1,612 @@
+import concurrent.futures
+import datetime
+import logging
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from server.config import get_config_manager
+from server.tools.file_system import DeferredFileOperation, FileOperation, is_path_valid, normalize_path
+from server.tools.mime_types import get_mime_type, sniff_content
+from server.utils.compressed import COMPRESSION_FORMATS, inner_mime_type, sniff_compressed
+from server.utils.execute_with_timeout import get_parallel_pool, soft_deadline
+from server.utils.table_aggregate import ColumnAggregate
+
+TABLE_READ_TIMEOUT = 10  # seconds
+TABLE_SCAN_TIMEOUT = 120  # seconds
+TABLE_AGGREGATE_TIMEOUT = 6 * 60 * 60  # seconds
+
+# Rows parsed to infer the schema
+SCHEMA_SAMPLE_ROWS = 1000
+# Rows parsed at a time when a whole table is scanned
+TABLE_CHUNK_ROWS = 100_000
+# Larger tables are described by streaming aggregation instead of being loaded whole
+TABLE_IN_MEMORY_MAX_SIZE = 256 * 1024 * 1024
+# Assumed expansion of compressed tables, to compare them with TABLE_IN_MEMORY_MAX_SIZE
+TABLE_COMPRESSION_RATIO = 8
+# Progress of an aggregation is reported at most this often
+TABLE_PROGRESS_INTERVAL = 0.5  # seconds
+# Maximum number of rows returned by table_head
+MAX_TABLE_ROWS = 1000
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+
+# pandas names of the compression formats
+PANDAS_COMPRESSION = {
+    'gzip': 'gzip',
+    'bzip2': 'bz2',
+    'xz': 'xz',
+    'zstd': 'zstd',
+}
+
+
+def json_value(value: Any) -> Any:
+    """
+    Convert a pandas or numpy scalar to a JSON-friendly value, missing values become None
+    """
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return str(value)
+    return value
+
+
+def dataframe_rows(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    return [
+        {str(column): json_value(value) for column, value in zip(df.columns, row)}
+        for row in df.itertuples(index=False, name=None)
+    ]
+
+
+def _read_options(path: str, delimiter: Optional[str]) -> Dict[str, Any]:
+    """
+    Validate a table path and build the pandas.read_csv arguments to read it, the file is
+    stat-ed and sniffed so this runs on the worker pool (see DeferredFileOperation)
+
+    :param path: The path to the table
+    :param delimiter: The field delimiter, None to choose from the file name (tab for .tsv, comma otherwise)
+    :return: Keyword arguments for pandas.read_csv, with the normalized path as filepath_or_buffer
+    """
+    if not path:
+        raise ValueError("Path is empty")
+
+    path = normalize_path(path)
+    if not is_path_valid(path):
+        logging.error(f"Path is not valid: {path}")
+        raise ValueError(f"Path is not valid: {path}")
+
+    if not os.path.exists(path):
+        logging.error(f"Path does not exist: {path}")
+        raise FileNotFoundError(f"Path does not exist: {path}")
+
+    if os.path.isdir(path):
+        logging.error(f"Path is a directory: {path}")
+        raise ValueError(f"Path is a directory: {path}")
+
+    compression = COMPRESSION_FORMATS.get(get_mime_type(path))
+    if compression:
+        sniffed = sniff_compressed(path, compression)
+    else:
+        sniffed = sniff_content(path)
+    if sniffed.is_binary:
+        logging.error(f"Not a text table: {path}")
+        raise ValueError(f"Not a text table: {path}")
+
+    if delimiter is None:
+        mime_type = inner_mime_type(path) if compression else get_mime_type(path)
+        delimiter = '\t' if mime_type == 'text/tab-separated-values' else ','
+    if not delimiter:
+        raise ValueError("Delimiter is empty")
+
+    return {
+        'filepath_or_buffer': path,
+        'sep': delimiter,
+        'encoding': sniffed.encoding or 'utf-8',
+        'compression': PANDAS_COMPRESSION.get(compression) if compression else None,
+    }
+
+
+def _check_dtypes(header: pd.Index, dtypes: Optional[Dict[str, str]], path: str) -> None:
+    if not dtypes:
+        return
+    _check_columns(header, list(dtypes), path)
+    for column, dtype in dtypes.items():
+        try:
+            parsed = pd.api.types.pandas_dtype(dtype)
+        except TypeError:
+            logging.error(f"Invalid dtype for column {column}: {dtype}")
+            raise ValueError(f"Invalid dtype for column {column}: {dtype}")
+        if pd.api.types.is_datetime64_any_dtype(parsed) or pd.api.types.is_timedelta64_dtype(parsed):
+            # read_csv cannot parse these as dtypes
+            logging.error(f"Unsupported dtype for column {column}: {dtype}")
+            raise ValueError(f"Unsupported dtype for column {column}: {dtype}, read dates as 'string'")
+
+
+def is_numeric_column(dtype) -> bool:
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def _check_columns(header: pd.Index, columns: Optional[List[str]], path: str) -> None:
+    if columns is None:
+        return
+    if not columns:
+        raise ValueError("Columns are empty")
+    missing = [column for column in columns if column not in header]
+    if missing:
+        logging.error(f"Columns not found in {path}: {missing}")
+        raise ValueError(f"Columns not found in {path}: {', '.join(map(str, missing))}")
+
+
+def table_schema(path: str, delimiter: str = None, sample_rows: int = SCHEMA_SAMPLE_ROWS) -> dict:
+    """
+    Infer the schema of a CSV file from its first rows
+
+    :param path: The path to the CSV file, may be compressed
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise)
+    :param sample_rows: Number of rows parsed to infer the column types
+    :return: Dict with the path, the columns (name, dtype, nullable) and the number of rows sampled
+    """
+    return _table_schema_operation(path, delimiter, sample_rows).run()
+
+
+async def table_schema_async(path: str, delimiter: str = None, sample_rows: int = SCHEMA_SAMPLE_ROWS) -> dict:
+    """
+    Async variant of table_schema
+    """
+    return await _table_schema_operation(path, delimiter, sample_rows).run_async()
+
+
+def _table_schema_operation(path: str, delimiter: Optional[str], sample_rows: int) -> DeferredFileOperation:
+    return DeferredFileOperation(lambda: _prepare_table_schema(path, delimiter, sample_rows), TABLE_READ_TIMEOUT)
+
+
+def _prepare_table_schema(path: str, delimiter: Optional[str], sample_rows: int) -> FileOperation:
+    options = _read_options(path, delimiter)
+    if sample_rows <= 0:
+        raise ValueError("Sample rows must be greater than 0")
+
+    def schema_operation() -> dict:
+        try:
+            df = pd.read_csv(**options, nrows=sample_rows)
+        except Exception as e:
+            logging.error(f"Error reading table {options['filepath_or_buffer']}: {e}")
+            raise e
+        nulls = df.isna().any()
+        return {
+            'path': options['filepath_or_buffer'],
+            'columns': [
+                {'name': str(column), 'dtype': str(dtype), 'nullable': bool(nulls[column])}
+                for column, dtype in df.dtypes.items()
+            ],
+            'sample_rows': len(df),
+        }
+
+    return FileOperation(schema_operation, TABLE_READ_TIMEOUT)
+
+
+def table_row_count(path: str, delimiter: str = None) -> dict:
+    """
+    Count the data rows of a CSV file, quoted line breaks do not start a new row
+
+    :param path: The path to the CSV file, may be compressed
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise)
+    :return: Dict with the path and the number of rows, without the header
+    """
+    return _table_row_count_operation(path, delimiter).run()
+
+
+async def table_row_count_async(path: str, delimiter: str = None) -> dict:
+    """
+    Async variant of table_row_count
+    """
+    return await _table_row_count_operation(path, delimiter).run_async()
+
+
+def _table_row_count_operation(path: str, delimiter: Optional[str]) -> DeferredFileOperation:
+    return DeferredFileOperation(lambda: _prepare_table_row_count(path, delimiter), TABLE_READ_TIMEOUT)
+
+
+def _prepare_table_row_count(path: str, delimiter: Optional[str]) -> FileOperation:
+    options = _read_options(path, delimiter)
+
+    def row_count_operation() -> dict:
+        rows = 0
+        try:
+            # Only the first column is kept, as strings, so the rows are split but hardly parsed
+            with pd.read_csv(**options, usecols=[0], dtype=str, chunksize=TABLE_CHUNK_ROWS) as reader:
+                for chunk in reader:
+                    rows += len(chunk)
+        except Exception as e:
+            logging.error(f"Error reading table {options['filepath_or_buffer']}: {e}")
+            raise e
+        return {'path': options['filepath_or_buffer'], 'rows': rows}
+
+    return FileOperation(row_count_operation, TABLE_SCAN_TIMEOUT)
+
+
+def describe_column(series: pd.Series, quantiles: List[float]) -> dict:
+    """
+    Compute the statistics of one column
+
+    :param series: The column
+    :param quantiles: The quantiles to compute for numeric columns, between 0 and 1
+    :return: Dict with dtype, count, null_count, distinct and, for numeric columns,
+        min, max, mean, std and quantiles
+    """
+    stats = {
+        'dtype': str(series.dtype),
+        'count': int(series.count()),
+        'null_count': int(series.isna().sum()),
+        'distinct': int(series.nunique()),
+    }
+    if is_numeric_column(series.dtype):
+        stats.update({
+            'min': json_value(series.min()),
+            'max': json_value(series.max()),
+            'mean': json_value(series.mean()),
+            'std': json_value(series.std()),
+            'quantiles': {str(q): json_value(v) for q, v in zip(quantiles, series.quantile(quantiles))},
+        })
+    else:
+        counts = series.value_counts()
+        if len(counts):
+            stats.update({'top': json_value(counts.index[0]), 'top_count': int(counts.iloc[0])})
+    return stats
+
+
+def table_stats(
+        path: str,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Compute per-column statistics of a CSV file
+
+    Tables larger than TABLE_IN_MEMORY_MAX_SIZE are not loaded whole but aggregated chunk
+    by chunk, see table_aggregate. The result has the same fields, with approximate set as
+    distinct, quantiles and top_count are then estimates.
+
+    :param path: The path to the CSV file, may be compressed
+    :param columns: The columns to describe (default: all)
+    :param quantiles: The quantiles of numeric columns, between 0 and 1 (default: 0.25, 0.5, 0.75)
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise)
+    :param dtypes: The pandas dtypes of some columns, e.g. {'id': 'string'} (default: inferred)
+    :param progress: Optional callback called with the bytes read so far and the size of the file
+    :return: Dict with the path, the number of rows, the statistics of each column, whether
+        they are approximate and whether the file was only partly read
+    """
+    return _table_stats_operation(path, columns, quantiles, delimiter, dtypes, progress).run()
+
+
+async def table_stats_async(
+        path: str,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Async variant of table_stats
+    """
+    return await _table_stats_operation(path, columns, quantiles, delimiter, dtypes, progress).run_async()
+
+
+def _table_stats_operation(
+        path: str,
+        columns: Optional[List[str]],
+        quantiles: Optional[List[float]],
+        delimiter: Optional[str],
+        dtypes: Optional[Dict[str, str]] = None,
+        progress: Optional[Callable[[float, Optional[float]], None]] = None
+) -> DeferredFileOperation:
+    return DeferredFileOperation(
+        lambda: _prepare_table_stats(path, columns, quantiles, delimiter, dtypes, progress), TABLE_READ_TIMEOUT
+    )
+
+
+def _prepare_table_stats(
+        path: str,
+        columns: Optional[List[str]],
+        quantiles: Optional[List[float]],
+        delimiter: Optional[str],
+        dtypes: Optional[Dict[str, str]],
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> FileOperation:
+    options = _read_options(path, delimiter)
+    size = os.path.getsize(options['filepath_or_buffer'])
+    if options['compression']:
+        size *= TABLE_COMPRESSION_RATIO
+    if size > TABLE_IN_MEMORY_MAX_SIZE:
+        return _prepare_table_aggregate(path, columns, quantiles, delimiter, dtypes, None, progress)
+
+    quantiles = list(DEFAULT_QUANTILES if quantiles is None else quantiles)
+    if any(not 0 <= q <= 1 for q in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1")
+    header = pd.read_csv(**options, nrows=0).columns
+    _check_columns(header, columns, options['filepath_or_buffer'])
+    _check_dtypes(header, dtypes, options['filepath_or_buffer'])
+
+    def stats_operation() -> dict:
+        try:
+            df = pd.read_csv(**options, usecols=columns, dtype=dtypes)
+        except Exception as e:
+            logging.error(f"Error reading table {options['filepath_or_buffer']}: {e}")
+            raise e
+        return {
+            'path': options['filepath_or_buffer'],
+            'rows': len(df),
+            'columns': {str(column): describe_column(df[column], quantiles) for column in df.columns},
+            'approximate': False,
+            'truncated': False,
+        }
+
+    return FileOperation(stats_operation, TABLE_SCAN_TIMEOUT)
+
+
+def table_aggregate(
+        path: str,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None,
+        chunk_rows: int = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Compute per-column statistics of a CSV file of any size, reading it in chunks
+
+    Only the selected columns are parsed, with dtypes fixed up front (inferred from the first
+    rows unless given), and each chunk is merged into running statistics whose size does not
+    depend on the number of rows: sums, counts, Welford variance, HyperLogLog distinct counts
+    and t-digest quantiles. Memory use is bounded by the chunk size. distinct and quantiles
+    are approximate.
+
+    :param path: The path to the CSV file, may be compressed
+    :param columns: The columns to describe (default: all)
+    :param quantiles: The quantiles of numeric columns, between 0 and 1 (default: 0.25, 0.5, 0.75)
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise)
+    :param dtypes: The pandas dtypes of some columns, e.g. {'id': 'string'} (default: numeric columns
+        of the first rows are read as float64, the others as strings)
+    :param chunk_rows: Rows parsed at a time (default: from config or 100000)
+    :param progress: Optional callback called with the bytes read so far and the size of the file
+    :return: Dict with the path, the number of rows, the statistics of each column, approximate
+        and whether the time ran out before the end of the file (truncated)
+    """
+    return _table_aggregate_operation(path, columns, quantiles, delimiter, dtypes, chunk_rows, progress).run()
+
+
+async def table_aggregate_async(
+        path: str,
+        columns: List[str] = None,
+        quantiles: List[float] = None,
+        delimiter: str = None,
+        dtypes: Dict[str, str] = None,
+        chunk_rows: int = None,
+        progress: Callable[[float, Optional[float]], None] = None
+) -> dict:
+    """
+    Async variant of table_aggregate
+    """
+    return await _table_aggregate_operation(
+        path, columns, quantiles, delimiter, dtypes, chunk_rows, progress
+    ).run_async()
+
+
+def _table_aggregate_operation(
+        path: str,
+        columns: Optional[List[str]],
+        quantiles: Optional[List[float]],
+        delimiter: Optional[str],
+        dtypes: Optional[Dict[str, str]],
+        chunk_rows: Optional[int],
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> DeferredFileOperation:
+    return DeferredFileOperation(
+        lambda: _prepare_table_aggregate(path, columns, quantiles, delimiter, dtypes, chunk_rows, progress),
+        TABLE_READ_TIMEOUT
+    )
+
+
+def _prepare_table_aggregate(
+        path: str,
+        columns: Optional[List[str]],
+        quantiles: Optional[List[float]],
+        delimiter: Optional[str],
+        dtypes: Optional[Dict[str, str]],
+        chunk_rows: Optional[int],
+        progress: Optional[Callable[[float, Optional[float]], None]]
+) -> FileOperation:
+    options = _read_options(path, delimiter)
+    path = options['filepath_or_buffer']
+    quantiles = list(DEFAULT_QUANTILES if quantiles is None else quantiles)
+    if any(not 0 <= q <= 1 for q in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1")
+    if chunk_rows is None:
+        chunk_rows = get_config_manager().config.get("table_chunk_rows", TABLE_CHUNK_ROWS)
+    if chunk_rows <= 0:
+        raise ValueError("Chunk rows must be greater than 0")
+    header = pd.read_csv(**options, nrows=0).columns
+    _check_columns(header, columns, path)
+    _check_dtypes(header, dtypes, path)
+
+    def read_dtypes() -> Dict[str, Any]:
+        # Fix the dtype of every column so that all the chunks agree and are not re-inferred,
+        # integer columns are read as float64 as later chunks may have missing values
+        sample = pd.read_csv(**options, usecols=columns, dtype=dtypes, nrows=SCHEMA_SAMPLE_ROWS)
+        result = {
+            column: np.dtype(np.float64) if is_numeric_column(dtype) else np.dtype(object)
+            for column, dtype in sample.dtypes.items()
+        }
+        for column, dtype in (dtypes or {}).items():
+            result[column] = pd.api.types.pandas_dtype(dtype)
+        return result
+
+    def aggregate_operation() -> dict:
+        deadline = soft_deadline(TABLE_AGGREGATE_TIMEOUT)
+        total = os.path.getsize(path)
+        pool = get_parallel_pool()
+        rows = 0
+        truncated = False
+        last_report = 0.0
+        pending: List[concurrent.futures.Future] = []
+        try:
+            column_dtypes = read_dtypes()
+            aggregates = {
+                column: ColumnAggregate(str(dtype), is_numeric_column(dtype))
+                for column, dtype in column_dtypes.items()
+            }
+            with open(path, 'rb') as f, pd.read_csv(
+                    **{**options, 'filepath_or_buffer': f},
+                    usecols=columns,
+                    dtype=column_dtypes,
+                    chunksize=chunk_rows
+            ) as reader:
+                for chunk in reader:
+                    # The columns of the previous chunk are aggregated in parallel while this one was parsed
+                    for future in pending:
+                        future.result()
+                    rows += len(chunk)
+                    pending = [pool.submit_or_run(aggregates[column].update, chunk[column]) for column in chunk.columns]
+                    now = time.monotonic()
+                    if progress and now - last_report >= TABLE_PROGRESS_INTERVAL:
+                        last_report = now
+                        progress(f.tell(), total)
+                    if now > deadline:
+                        truncated = True
+                        break
+                for future in pending:
+                    future.result()
+        except ValueError as e:
+            logging.error(f"Error reading table {path}: {e}")
+            raise ValueError(f"Error reading table {path}: {e}, set dtypes for columns whose type differs from the first rows")
+        except Exception as e:
+            logging.error(f"Error reading table {path}: {e}")
+            raise e
+        finally:
+            concurrent.futures.wait(pending)
+        if progress and not truncated:
+            progress(total, total)
+        return {
+            'path': path,
+            'rows': rows,
+            'columns': {
+                str(column): {
+                    key: {q: json_value(v) for q, v in value.items()} if isinstance(value, dict) else json_value(value)
+                    for key, value in aggregate.result(quantiles).items()
+                }
+                for column, aggregate in aggregates.items()
+            },
+            'approximate': True,
+            'truncated': truncated,
+        }
+
+    return FileOperation(aggregate_operation, TABLE_AGGREGATE_TIMEOUT)
+
+
+def table_head(
+        path: str,
+        rows: int = 10,
+        sample: bool = False,
+        seed: int = None,
+        columns: List[str] = None,
+        delimiter: str = None
+) -> dict:
+    """
+    Return the first rows of a CSV file, or a uniform random sample of its rows
+
+    :param path: The path to the CSV file, may be compressed
+    :param rows: Number of rows to return, at most MAX_TABLE_ROWS
+    :param sample: If True, return randomly chosen rows (in file order) instead of the first ones
+    :param seed: Seed of the random sample, for repeatable samples
+    :param columns: The columns to return (default: all)
+    :param delimiter: The field delimiter (default: tab for .tsv files, comma otherwise)
+    :return: Dict with the path, the column names and the rows as dicts
+    """
+    return _table_head_operation(path, rows, sample, seed, columns, delimiter).run()
+
+
+async def table_head_async(
+        path: str,
+        rows: int = 10,
+        sample: bool = False,
+        seed: int = None,
+        columns: List[str] = None,
+        delimiter: str = None
+) -> dict:
+    """
+    Async variant of table_head
+    """
+    return await _table_head_operation(path, rows, sample, seed, columns, delimiter).run_async()
+
+
+def _table_head_operation(
+        path: str,
+        rows: int,
+        sample: bool,
+        seed: Optional[int],
+        columns: Optional[List[str]],
+        delimiter: Optional[str]
+) -> DeferredFileOperation:
+    return DeferredFileOperation(
+        lambda: _prepare_table_head(path, rows, sample, seed, columns, delimiter), TABLE_READ_TIMEOUT
+    )
+
+
+def _prepare_table_head(
+        path: str,
+        rows: int,
+        sample: bool,
+        seed: Optional[int],
+        columns: Optional[List[str]],
+        delimiter: Optional[str]
+) -> FileOperation:
+    options = _read_options(path, delimiter)
+    if rows <= 0:
+        raise ValueError("Rows must be greater than 0")
+    rows = min(rows, MAX_TABLE_ROWS)
+    _check_columns(pd.read_csv(**options, nrows=0).columns, columns, options['filepath_or_buffer'])
+
+    def sample_rows() -> pd.DataFrame:
+        # Give every row a random key and keep the rows with the smallest keys,
+        # a uniform sample without holding more than one chunk in memory
+        rng = np.random.default_rng(seed)
+        kept = None
+        with pd.read_csv(**options, usecols=columns, chunksize=TABLE_CHUNK_ROWS) as reader:
+            for chunk in reader:
+                keys = pd.Series(rng.random(len(chunk)), index=chunk.index)
+                chunk = chunk.assign(_sample_key=keys)
+                kept = chunk if kept is None else pd.concat([kept, chunk])
+                kept = kept.nsmallest(rows, '_sample_key')
+        if kept is None:
+            return pd.read_csv(**options, usecols=columns, nrows=0)
+        return kept.sort_index().drop(columns='_sample_key')
+
+    def head_operation() -> dict:
+        try:
+            if sample:
+                df = sample_rows()
+            else:
+                df = pd.read_csv(**options, usecols=columns, nrows=rows)
+        except Exception as e:
+            logging.error(f"Error reading table {options['filepath_or_buffer']}: {e}")
+            raise e
+        return {
+            'path': options['filepath_or_buffer'],
+            'columns': [str(column) for column in df.columns],
+            'rows': dataframe_rows(df),
+        }
+
+    return FileOperation(head_operation, TABLE_SCAN_TIMEOUT if sample else TABLE_READ_TIMEOUT)
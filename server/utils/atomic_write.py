@@ -0,0 +1,177 @@
+import contextvars
+import logging
+import os
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Set
+
+from server.config import get_config_manager
+from server.utils.execute_with_timeout import is_abandoned
+
+FSYNC_POLICIES = ("none", "file", "group")
+
+
+def get_fsync_policy() -> str:
+    """
+    Get the fsync policy from the configuration, 'none' if it is not set
+    """
+    fsync_policy = get_config_manager().get_value("fsync_policy") or "none"
+    if fsync_policy not in FSYNC_POLICIES:
+        logging.error(f"Invalid fsync policy: {fsync_policy}")
+        raise ValueError(f"Invalid fsync policy: {fsync_policy}, expected one of {', '.join(FSYNC_POLICIES)}")
+    return fsync_policy
+
+
+# Permission bits new files get from open(), computed once as the umask can only be read by setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def fsync_directory(directory: str) -> None:
+    """
+    Make the entries of a directory (e.g. a rename into it) durable
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        # Directories cannot be opened on some platforms (e.g. Windows), nothing to sync
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_file(fd: int) -> None:
+    """
+    Make the content of an open file durable, skipping metadata where the platform allows
+    """
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+class WriteGroup:
+    """
+    Directories whose fsync is deferred until the group commits.
+
+    Under the group fsync policy, the content of each file is still synced before it is
+    renamed into place, but every directory is only synced once per group however many
+    files were renamed into it.
+    """
+
+    def __init__(self):
+        self._directories: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def add(self, directory: str) -> None:
+        with self._lock:
+            self._directories.add(directory)
+
+    def commit(self) -> None:
+        with self._lock:
+            directories, self._directories = self._directories, set()
+        for directory in directories:
+            fsync_directory(directory)
+
+
+_write_group: contextvars.ContextVar[Optional[WriteGroup]] = contextvars.ContextVar("write_group", default=None)
+
+
+@contextmanager
+def write_group() -> Iterator[WriteGroup]:
+    """
+    Group the atomic writes made in this context (including tasks submitted to the worker
+    pools from it), committing the deferred directory syncs on exit
+    """
+    group = WriteGroup()
+    token = _write_group.set(group)
+    try:
+        yield group
+    finally:
+        _write_group.reset(token)
+        group.commit()
+
+
+class AtomicFile:
+    """
+    A file written to a temporary file next to its target and renamed over it on commit.
+
+    Readers see either the old or the new content, never a partially written file, and
+    a write that fails, or whose pool task was abandoned after a timeout before the
+    rename, leaves the target untouched.
+    """
+
+    def __init__(self, path: str, fsync_policy: str = "none"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}, expected one of {', '.join(FSYNC_POLICIES)}")
+        # Replace the target of a symbolic link, not the link itself
+        self.path = os.path.realpath(path)
+        self.fsync_policy = fsync_policy
+        directory, name = os.path.split(self.path)
+        fd, self.temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        try:
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except FileNotFoundError:
+                mode = 0o666 & ~_umask
+            if hasattr(os, "fchmod"):
+                os.fchmod(fd, mode)
+            self.file = os.fdopen(fd, "wb")
+        except Exception:
+            os.close(fd)
+            os.unlink(self.temp_path)
+            raise
+
+    def write(self, data: bytes) -> int:
+        return self.file.write(data)
+
+    def commit(self) -> None:
+        """
+        Sync the content according to the fsync policy and rename it over the target
+        """
+        try:
+            self.file.flush()
+            if self.fsync_policy != "none":
+                fsync_file(self.file.fileno())
+            self.file.close()
+            if is_abandoned():
+                # The caller was told the write timed out, it must not happen later
+                raise TimeoutError(f"Write to {self.path} was abandoned after a timeout")
+            os.replace(self.temp_path, self.path)
+        except Exception:
+            self.abort()
+            raise
+        directory = os.path.dirname(self.path)
+        group = _write_group.get()
+        if self.fsync_policy == "group" and group is not None:
+            group.add(directory)
+        elif self.fsync_policy != "none":
+            fsync_directory(directory)
+
+    def abort(self) -> None:
+        """
+        Discard the written content, the target is left untouched
+        """
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Error removing temporary file {self.temp_path}: {e}")
+
+    def __enter__(self) -> "AtomicFile":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -0,0 +1,225 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import threading
+import zlib
+from collections import deque
+from contextlib import closing
+from dataclasses import dataclass
+from itertools import islice
+from typing import BinaryIO, Iterator, List, Optional
+
+from server.tools.mime_types import SNIFF_SIZE, ContentSniff, detect_content, get_extension_type
+from server.utils.file_cache import FileCache, file_identity
+from server.utils.fs_watcher import add_change_listener
+from server.utils.line_index import read_text_lines
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression formats by the mime type detected from the magic number
+COMPRESSION_FORMATS = {
+    'application/gzip': 'gzip',
+    'application/x-bzip2': 'bzip2',
+    'application/x-xz': 'xz',
+    'application/zstd': 'zstd',
+}
+COMPRESSION_EXTENSIONS = ('.gz', '.gzip', '.bz2', '.xz', '.zst')
+
+# Compressed bytes fed to the decompressor at a time
+DECOMPRESS_CHUNK_SIZE = 256 * 1024
+# A gzip checkpoint is recorded every GZIP_CHECKPOINT_SPACING decompressed bytes,
+# each one holds a copy of the inflate state (about 40 KiB)
+GZIP_CHECKPOINT_SPACING = 8 * 1024 * 1024
+GZIP_MAX_CHECKPOINTS = 1024
+# Checkpoints are not recorded in the middle of lines longer than this
+GZIP_MAX_CARRY = 64 * 1024
+
+
+def decompression_available(compression: str) -> bool:
+    return compression != 'zstd' or zstandard is not None
+
+
+def open_decompressed(path: str, compression: str) -> BinaryIO:
+    """
+    Open a compressed file as a stream of its decompressed bytes
+
+    :param path: The path to the file
+    :param compression: One of the values of COMPRESSION_FORMATS
+    :return: A binary file object, to be closed by the caller
+    """
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'bzip2':
+        return bz2.open(path, 'rb')
+    if compression == 'xz':
+        return lzma.open(path, 'rb')
+    if compression == 'zstd' and zstandard is not None:
+        f = open(path, 'rb')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True))
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def inner_mime_type(path: str) -> str:
+    """
+    Get the mime type of the decompressed content from the name without its compression suffix
+    """
+    name = path
+    if name.lower().endswith(COMPRESSION_EXTENSIONS):
+        name = os.path.splitext(name)[0]
+    return get_extension_type(name) or 'text/plain'
+
+
+_compressed_sniff_cache = FileCache(max_entries=256)
+add_change_listener(_compressed_sniff_cache.invalidate)
+
+
+def sniff_compressed(path: str, compression: str) -> ContentSniff:
+    """
+    Sniff the decompressed content of a compressed file, cached per file identity
+
+    Files that cannot be decompressed are reported as binary.
+    """
+    identity = file_identity(path)
+    sniffed = _compressed_sniff_cache.get(path, identity)
+    if sniffed is None:
+        try:
+            with open_decompressed(path, compression) as f:
+                sniffed = detect_content(f.read(SNIFF_SIZE))
+        except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError):
+            sniffed = ContentSniff(is_binary=True)
+        _compressed_sniff_cache.put(path, identity, sniffed)
+    return sniffed
+
+
+@dataclass
+class GzipCheckpoint:
+    """
+    State of the decompression of a gzip file after its first `offset` compressed bytes
+    """
+    line: int
+    offset: int
+    # The inflate state, None at the start of the file
+    decompressor: Optional[object]
+    # The beginning of line `line`, decompressed but not yet ended by a newline
+    carry: bytes
+    decompressed: int
+
+
+class GzipCheckpoints:
+    """
+    Checkpoints of the decompression of a gzip file, so a window deep into the file is
+    read by resuming from the nearest checkpoint instead of inflating from the start.
+
+    Like LineIndex, checkpoints are added lazily as the file is read.
+    """
+
+    def __init__(self):
+        self.checkpoints: List[GzipCheckpoint] = [GzipCheckpoint(0, 0, None, b"", 0)]
+        self._lock = threading.Lock()
+
+    def nearest(self, line: int) -> GzipCheckpoint:
+        with self._lock:
+            best = self.checkpoints[0]
+            for checkpoint in self.checkpoints:
+                if checkpoint.line > line:
+                    break
+                best = checkpoint
+            return best
+
+    def record(self, line: int, offset: int, decompressor, carry: bytes, decompressed: int) -> None:
+        with self._lock:
+            last = self.checkpoints[-1]
+            if (offset <= last.offset or decompressed - last.decompressed < GZIP_CHECKPOINT_SPACING
+                    or len(carry) > GZIP_MAX_CARRY or len(self.checkpoints) >= GZIP_MAX_CHECKPOINTS):
+                return
+            self.checkpoints.append(GzipCheckpoint(line, offset, decompressor.copy(), carry, decompressed))
+
+
+_gzip_checkpoints = FileCache(max_entries=16)
+add_change_listener(_gzip_checkpoints.invalidate)
+
+
+def iter_gzip_lines(path: str, start: int) -> Iterator[bytes]:
+    """
+    Iterate over the lines of a gzip file from a line on, resuming from the nearest checkpoint
+
+    Concatenated gzip members are decompressed as one stream, like gzip.open does.
+
+    :param path: The path to the file
+    :param start: The first line to yield
+    :return: An iterator of lines, with their line endings
+    """
+    with open(path, 'rb') as f:
+        identity = file_identity(path, os.fstat(f.fileno()))
+        checkpoints = _gzip_checkpoints.get(path, identity)
+        if checkpoints is None:
+            checkpoints = GzipCheckpoints()
+            _gzip_checkpoints.put(path, identity, checkpoints)
+        checkpoint = checkpoints.nearest(start)
+        f.seek(checkpoint.offset)
+        decompressor = checkpoint.decompressor.copy() if checkpoint.decompressor else zlib.decompressobj(31)
+        line, carry, decompressed = checkpoint.line, checkpoint.carry, checkpoint.decompressed
+        while True:
+            chunk = f.read(DECOMPRESS_CHUNK_SIZE)
+            if not chunk:
+                if carry and line >= start:
+                    yield carry
+                return
+            out = []
+            while chunk:
+                if decompressor.eof:
+                    # The next member of a multi-member file
+                    decompressor = zlib.decompressobj(31)
+                out.append(decompressor.decompress(chunk))
+                chunk = decompressor.unused_data if decompressor.eof else b""
+            data = carry + b"".join(out)
+            decompressed += len(data) - len(carry)
+            end = data.rfind(b"\n") + 1
+            carry = data[end:]
+            count = data.count(b"\n", 0, end)
+            # A chunk without a line break only extends the carried partial line
+            if count and line + count > start:
+                lines = [part + b"\n" for part in data[:end - 1].split(b"\n")]
+                yield from lines[max(start - line, 0):]
+            line += count
+            checkpoints.record(line, f.tell(), decompressor, carry, decompressed)
+
+
+def read_compressed_lines(path: str, compression: str, offset: int, length: int, encoding: str) -> str:
+    """
+    Read a window of lines of the decompressed content of a file
+
+    :param path: The path to the file
+    :param compression: One of the values of COMPRESSION_FORMATS
+    :param offset: Number of lines to skip, negative values count back from the end of the content
+    :param length: Maximum number of lines to return
+    :param encoding: The encoding of the decompressed content
+    :return: The selected lines joined together
+    """
+    if length <= 0:
+        return ""
+    if encoding not in ('utf-8', 'utf-8-sig'):
+        # Line breaks of e.g. UTF-16 cannot be found by scanning bytes
+        with open_decompressed(path, compression) as f:
+            return read_text_lines(io.TextIOWrapper(f, encoding=encoding), offset, length)
+    if compression == 'gzip':
+        with closing(iter_gzip_lines(path, max(offset, 0))) as lines:
+            selected = deque(lines, maxlen=-offset) if offset < 0 else lines
+            content = b"".join(islice(selected, length))
+    else:
+        with open_decompressed(path, compression) as f:
+            if offset < 0:
+                content = b"".join(islice(deque(f, maxlen=-offset), length))
+            else:
+                content = b"".join(islice(f, offset, offset + length))
+    return content.decode(encoding).replace('\r\n', '\n')
+
+
+def read_compressed_all(path: str, compression: str, encoding: str) -> str:
+    with open_decompressed(path, compression) as f:
+        return io.TextIOWrapper(f, encoding=encoding).read()
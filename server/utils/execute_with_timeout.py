@@ -1,10 +1,209 @@
 import asyncio
 import concurrent.futures
+import contextvars
 import logging
-from typing import Callable, Any, TypeVar, Optional
+import os
+import threading
+import time
+from typing import Callable, Any, Dict, FrozenSet, TypeVar, Optional
+
+from server.config import get_config_manager
 
 T = TypeVar('T')
 
+# Names of the pools the current call is running on, propagated to submitted tasks
+_active_pools: contextvars.ContextVar[FrozenSet[str]] = contextvars.ContextVar("active_pools", default=frozenset())
+
+
+class Cancellation:
+    """
+    Set when a pool task is abandoned after a timeout. Tasks it submitted to the pools
+    are abandoned along with it.
+    """
+
+    def __init__(self, parent: Optional["Cancellation"] = None):
+        self.parent = parent
+        self._event = threading.Event()
+
+    def set(self) -> None:
+        self._event.set()
+
+    def is_set(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.is_set())
+
+
+_cancellation: contextvars.ContextVar[Optional[Cancellation]] = contextvars.ContextVar("cancellation", default=None)
+
+
+def is_abandoned() -> bool:
+    """
+    Check whether the current pool task was abandoned after a timeout, so its caller no
+    longer waits for it. Tasks should check this before making changes the caller was told
+    did not happen.
+    """
+    cancellation = _cancellation.get()
+    return cancellation is not None and cancellation.is_set()
+
+
+class WorkerPool:
+    """
+    A bounded, long-lived thread pool shared by the whole process, with queue metrics.
+
+    Tasks that time out are cancelled if they have not started yet, otherwise they are
+    abandoned and keep their worker until they finish.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._abandoned = 0
+
+    def submit(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+        """
+        Submit a function to the pool
+
+        :param func: The function to execute.
+        :param args: Positional arguments to pass to the function.
+        :param kwargs: Keyword arguments to pass to the function.
+        :return: A future for the result of the function.
+        """
+        cancellation = Cancellation(_cancellation.get())
+
+        def run() -> T:
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+            _active_pools.set(_active_pools.get() | {self.name})
+            _cancellation.set(cancellation)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+
+        def on_done(future: concurrent.futures.Future) -> None:
+            if future.cancelled():
+                with self._lock:
+                    self._queued -= 1
+
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(contextvars.copy_context().run, run)
+        future.cancellation = cancellation
+        future.add_done_callback(on_done)
+        return future
+
+    def submit_or_run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+        """
+        Submit a function to the pool, or run it inline when the caller is already running
+        on this pool, so that tasks never wait on their own pool
+
+        :param func: The function to execute.
+        :param args: Positional arguments to pass to the function.
+        :param kwargs: Keyword arguments to pass to the function.
+        :return: A future for the result of the function.
+        """
+        if not self.is_current():
+            return self.submit(func, *args, **kwargs)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def is_current(self) -> bool:
+        """
+        Check whether the caller is (directly or indirectly) running on this pool
+        """
+        return self.name in _active_pools.get()
+
+    def abandon(self, future: concurrent.futures.Future) -> None:
+        """
+        Give up on a future, cancelling it if it has not started yet, otherwise the task
+        sees is_abandoned() from now on
+        """
+        cancellation = getattr(future, "cancellation", None)
+        if cancellation is not None:
+            cancellation.set()
+        if not future.cancel():
+            with self._lock:
+                self._abandoned += 1
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Get the current metrics of the pool
+
+        :return: A dict consist of follow k-v:
+            - max_workers (int): The number of worker threads.
+            - queued (int): Tasks waiting for a free worker.
+            - in_flight (int): Tasks currently running, including abandoned ones.
+            - completed (int): Tasks that have finished running.
+            - abandoned (int): Tasks that timed out after they had started running.
+        """
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "abandoned": self._abandoned,
+            }
+
+
+_worker_pool: Optional[WorkerPool] = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """
+    Get the process-wide worker pool used by execute_with_timeout, creating it on first use.
+    The size is read from the worker_pool_size configuration value.
+    """
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            config = get_config_manager()
+            max_workers = config.config.get("worker_pool_size") or min(32, (os.cpu_count() or 1) + 4)
+            _worker_pool = WorkerPool("file-worker", max_workers)
+        return _worker_pool
+
+
+_parallel_pool: Optional[WorkerPool] = None
+
+
+def get_parallel_pool() -> WorkerPool:
+    """
+    Get the process-wide pool used to fan out work inside a single operation (e.g. scanning
+    many directories or files), creating it on first use. The size is read from the
+    parallel_pool_size configuration value.
+    """
+    global _parallel_pool
+    with _worker_pool_lock:
+        if _parallel_pool is None:
+            config = get_config_manager()
+            max_workers = config.config.get("parallel_pool_size") or min(32, (os.cpu_count() or 1) + 4)
+            _parallel_pool = WorkerPool("parallel-worker", max_workers)
+        return _parallel_pool
+
+
+def soft_deadline(timeout: float) -> float:
+    """
+    Get a time.monotonic() deadline a little before a task's hard timeout, long tasks stop
+    at it and return what they have done so far instead of timing out with nothing
+
+    :param timeout: The hard timeout of the task, in seconds
+    :return: The deadline, comparable with time.monotonic()
+    """
+    return time.monotonic() + timeout * 0.9
+
+
 def execute_with_timeout(
         func: Callable[...,T],
         timeout: float,
@@ -14,7 +213,8 @@ def execute_with_timeout(
 ) -> Optional[T]:
     """
     Execute a function with a timeout. If the function does not complete within the timeout,
-    it returns a default value.
+    it returns a default value. The function runs on the shared worker pool and the caller
+    returns as soon as the timeout expires, without waiting for the worker.
 
     :param func: The function to execute.
     :param timeout: The timeout in seconds.
@@ -23,19 +223,27 @@ def execute_with_timeout(
     :param kwargs: Keyword arguments to pass to the function.
     :return: The result of the function or the default value if it times out.
     """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args, **kwargs)
+    pool = get_worker_pool()
+    if pool.is_current():
+        # Nested call from a pool worker, waiting on the pool from inside it could
+        # deadlock, so run inline under the timeout of the outer call
         try:
-            return future.result(timeout=timeout)
-        except concurrent.futures.TimeoutError:
-            future.cancel()
-            if default_value is not None:
-                return default_value
-            else:
-                raise TimeoutError(f"Function '{func.__name__}' timed out after {timeout} seconds.")
+            return func(*args, **kwargs)
         except Exception as e:
             logging.error(f"Error executing function '{func.__name__}': {e}")
             raise e
+    future = pool.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        pool.abandon(future)
+        if default_value is not None:
+            return default_value
+        else:
+            raise TimeoutError(f"Function '{func.__name__}' timed out after {timeout} seconds.")
+    except Exception as e:
+        logging.error(f"Error executing function '{func.__name__}': {e}")
+        raise e
         
 async def execute_with_timeout_async(
     func: Callable[..., T],
@@ -55,18 +263,17 @@ async def execute_with_timeout_async(
     :param kwargs: Keyword arguments to pass to the function.
     :return: The result of the function or the default value if it times out.
     """
-    loop = asyncio.get_event_loop()
+    pool = get_worker_pool()
+    future = pool.submit(func, *args, **kwargs)
     try:
-        result = await asyncio.wait_for(
-            loop.run_in_executor(None, lambda: func(*args, **kwargs)),
-            timeout=timeout
-        )
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
         return result
     except asyncio.TimeoutError:
+        pool.abandon(future)
         if default_value is not None:
             return default_value
         else:
             raise TimeoutError(f"Function '{func.__name__}' timed out after {timeout} seconds.")
     except Exception as e:
         logging.error(f"Error executing function '{func.__name__}': {e}")
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from server.utils.fs_watcher import change_sequence, is_watched
+
+FileIdentity = Tuple[int, int, int]
+
+
+def file_identity(path: str, st: Optional[os.stat_result] = None) -> FileIdentity:
+    """
+    Get the identity of a file, which changes whenever the file is replaced or modified
+
+    :param path: The path to the file
+    :param st: An already fetched stat result for the file, optional
+    :return: A (inode, size, mtime_ns) tuple
+    """
+    if st is None:
+        st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class FileCache:
+    """
+    Thread-safe LRU cache of per-file values.
+
+    Entries are keyed by path and tagged with the file identity they were computed for,
+    so a value is only returned while the file is unchanged.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, identity: FileIdentity) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if entry[0] != identity:
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path: str, identity: FileIdentity, value: Any) -> None:
+        with self._lock:
+            self._entries[path] = (identity, value)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forget a file, or everything below a directory
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            if self._entries.pop(path, None) is not None:
+                return
+            for entry in [p for p in self._entries if p.startswith(prefix)]:
+                del self._entries[entry]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DirectoryCache:
+    """
+    Thread-safe TTL/LRU set of directories known to exist.
+
+    Only positive results are cached, entries expire after ttl seconds so directories
+    removed outside of the server are noticed eventually. Entries of watched directories
+    do not expire, they are invalidated when the watcher publishes a change.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 5.0):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contains(self, path: str) -> bool:
+        with self._lock:
+            expires = self._entries.get(path)
+            if expires is None:
+                return False
+            if expires < time.monotonic() and not is_watched(path):
+                del self._entries[path]
+                return False
+            self._entries.move_to_end(path)
+            return True
+
+    def add(self, path: str, sequence: Optional[int] = None) -> None:
+        """
+        Remember that a directory exists
+
+        :param path: The directory
+        :param sequence: The change_sequence() read before the directory was checked, it is
+                         not cached if a change was published since, which may have been
+                         this directory being removed
+        """
+        with self._lock:
+            if sequence is not None and sequence != change_sequence():
+                return
+            self._entries[path] = time.monotonic() + self._ttl
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forget a directory and everything below it
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for entry in [p for p in self._entries if p == path or p.startswith(prefix)]:
+                del self._entries[entry]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
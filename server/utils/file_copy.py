@@ -0,0 +1,197 @@
+import concurrent.futures
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from server.utils.execute_with_timeout import get_parallel_pool
+
+# Bytes copied per system call, also the granularity of progress reports
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# Progress of a tree copy is reported at most this often
+COPY_PROGRESS_INTERVAL = 0.5  # seconds
+
+ProgressCallback = Callable[[int], None]
+
+
+def copy_file_data(src_fd: int, dst_fd: int, on_copied: Optional[ProgressCallback] = None) -> int:
+    """
+    Copy the content of one open file to another without passing it through Python
+
+    copy_file_range lets the kernel (or the file system, e.g. with reflinks) copy the data,
+    sendfile is used where it is not supported and a plain read/write loop as the last resort.
+
+    :param src_fd: The file descriptor to copy from, at offset 0
+    :param dst_fd: The file descriptor to copy to, at offset 0
+    :param on_copied: Optional callback called with the number of bytes copied by each step
+    :return: The number of bytes copied
+    """
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while True:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+                if n == 0:
+                    return copied
+                copied += n
+                if on_copied:
+                    on_copied(n)
+        except OSError as e:
+            if copied:
+                raise e
+            # Not supported between these files (e.g. EXDEV on older kernels, EINVAL), try the next method
+            logging.debug(f"{method} not usable, falling back: {e}")
+    while True:
+        data = os.read(src_fd, COPY_CHUNK_SIZE)
+        if not data:
+            return copied
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        copied += len(data)
+        if on_copied:
+            on_copied(len(data))
+
+
+def copy_file(src: str, dest: str, on_copied: Optional[ProgressCallback] = None) -> int:
+    """
+    Copy a file with its permission bits and timestamps, dest must not exist
+
+    :return: The number of bytes copied
+    """
+    with open(src, 'rb') as fsrc, open(dest, 'xb') as fdst:
+        copied = copy_file_data(fsrc.fileno(), fdst.fileno(), on_copied)
+    shutil.copystat(src, dest)
+    return copied
+
+
+def copy_tree(src: str, dest: str, progress: Optional[Callable[[float, Optional[float]], None]] = None) -> int:
+    """
+    Copy a directory tree, the files are copied in parallel on the parallel pool
+
+    Directories and symbolic links are created while the tree is listed, then the files
+    are copied. dest must not exist.
+
+    :param src: The directory to copy
+    :param dest: The path of the copy
+    :param progress: Optional callback called with the bytes copied so far and the total
+    :return: The number of bytes copied
+    """
+    files: List[Tuple[str, str]] = []
+    directories: List[Tuple[str, str]] = []
+    total = 0
+    stack = [(src, dest)]
+    while stack:
+        src_dir, dest_dir = stack.pop()
+        os.mkdir(dest_dir)
+        directories.append((src_dir, dest_dir))
+        with os.scandir(src_dir) as it:
+            for entry in it:
+                target = os.path.join(dest_dir, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    stack.append((entry.path, target))
+                elif entry.is_file():
+                    files.append((entry.path, target))
+                    total += entry.stat().st_size
+                else:
+                    raise ValueError(f"Cannot copy special file: {entry.path}")
+
+    lock = threading.Lock()
+    copied = 0
+    last_report = 0.0
+
+    def on_copied(n: int) -> None:
+        nonlocal copied, last_report
+        with lock:
+            copied += n
+            now = time.monotonic()
+            if not progress or now - last_report < COPY_PROGRESS_INTERVAL:
+                return
+            last_report = now
+            current = copied
+        progress(current, total)
+
+    pool = get_parallel_pool()
+    futures = [pool.submit_or_run(copy_file, s, d, on_copied) for s, d in files]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        raise
+    # Directory timestamps change while their content is created, so copy them last
+    for src_dir, dest_dir in reversed(directories):
+        shutil.copystat(src_dir, dest_dir)
+    if progress:
+        progress(copied, total)
+    return copied
+
+
+def is_same_device(src: str, dest: str) -> bool:
+    """
+    Check if dest (or its nearest existing ancestor) is on the same device as src
+    """
+    src_dev = os.lstat(src).st_dev
+    path = dest
+    while True:
+        try:
+            return os.stat(path).st_dev == src_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return True
+            path = parent
+
+
+def move_across_devices(src: str, dest: str, progress: Optional[Callable[[float, Optional[float]], None]] = None) -> None:
+    """
+    Move a file, symbolic link or directory tree to another file system
+
+    The source is copied to a temporary path next to dest, renamed into place and only
+    then removed, so an interrupted move leaves the source intact and no partial dest.
+
+    :param src: The path to move
+    :param dest: The destination path, replaced if it is a file
+    :param progress: Optional callback called with the bytes copied so far and the total
+    """
+    directory, name = os.path.split(dest)
+    staging = tempfile.mkdtemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        staged = os.path.join(staging, name)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), staged)
+        elif os.path.isdir(src):
+            copy_tree(src, staged, progress)
+        else:
+            total = os.stat(src).st_size
+            copied = 0
+
+            def on_copied(n: int) -> None:
+                nonlocal copied
+                copied += n
+                if progress:
+                    progress(copied, total)
+
+            copy_file(src, staged, on_copied)
+        if os.path.isdir(staged) and not os.path.islink(staged):
+            os.rename(staged, dest)
+        else:
+            os.replace(staged, dest)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.rmtree(src)
+    else:
+        os.remove(src)
@@ -0,0 +1,426 @@
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from server.config import get_config_manager
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+    | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+EVENT_HEADER = struct.Struct("iIII")
+EVENT_BUFFER_SIZE = 64 * 1024
+
+DEFAULT_POLL_INTERVAL = 10.0  # seconds
+# Trees with more entries are not polled, each poll would stat them all
+POLL_MAX_ENTRIES = 100_000
+DEFAULT_EXCLUDE = [".git", "node_modules", "__pycache__", ".venv"]
+
+ChangeListener = Callable[[str], None]
+
+_change_listeners: List[ChangeListener] = []
+_change_listeners_lock = threading.Lock()
+# Number of changes published so far, see change_sequence
+_change_sequence = 0
+
+
+def add_change_listener(listener: ChangeListener) -> None:
+    """
+    Register a callback receiving the normalized path of every file or directory that
+    changed, was created, moved or deleted. A directory path stands for everything below it.
+    """
+    with _change_listeners_lock:
+        _change_listeners.append(listener)
+
+
+def remove_change_listener(listener: ChangeListener) -> None:
+    with _change_listeners_lock:
+        if listener in _change_listeners:
+            _change_listeners.remove(listener)
+
+
+def change_sequence() -> int:
+    """
+    Get the number of changes published so far, read it before computing a cached value
+    to tell if a change was published meanwhile
+    """
+    return _change_sequence
+
+
+def publish_change(path: str) -> None:
+    """
+    Notify the registered listeners that a path changed
+
+    :param path: The normalized path that changed
+    """
+    global _change_sequence
+    with _change_listeners_lock:
+        _change_sequence += 1
+        listeners = list(_change_listeners)
+    for listener in listeners:
+        try:
+            listener(path)
+        except Exception as e:
+            logging.error(f"Error handling change of {path}: {e}")
+
+
+def _is_excluded(name: str, exclude: List[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in exclude)
+
+
+class InotifyWatcher:
+    """
+    Watches directory trees with inotify and publishes every change.
+
+    Each directory below the roots gets its own watch, directories created or moved
+    in later are added as their events arrive. If the kernel event queue overflows,
+    the roots themselves are published so listeners drop everything below them.
+    """
+
+    def __init__(self, roots: Iterable[str], exclude: List[str]):
+        self.roots = sorted(set(roots))
+        self.exclude = exclude
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._watches: Dict[int, str] = {}
+        # The watched directories, for watches()
+        self._directories: Set[str] = set()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # Cleared when changes may be missed from now on, e.g. a new directory could not be watched
+        self.active = True
+
+    def _add_watch(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached, raise fs.inotify.max_user_watches")
+            # The directory vanished or is not readable, nothing to watch
+            return
+        self._watches[wd] = directory
+        self._directories.add(directory)
+
+    def _add_tree(self, root: str) -> None:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            self._add_watch(directory)
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not _is_excluded(entry.name, self.exclude):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def _remove_tree(self, root: str) -> None:
+        prefix = root + os.sep
+        for wd, directory in list(self._watches.items()):
+            if directory == root or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._watches.pop(wd, None)
+                self._directories.discard(directory)
+
+    def watches(self, path: str) -> bool:
+        """
+        Check if changes to a path are published, i.e. it or its directory is watched
+        """
+        return self.active and (path in self._directories or os.path.dirname(path) in self._directories)
+
+    def start(self) -> None:
+        for root in self.roots:
+            self._add_tree(root)
+        self._thread = threading.Thread(target=self._run, name="fs-watcher", daemon=True)
+        self._thread.start()
+        logging.info(f"Watching {len(self._watches)} directories with inotify")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        os.write(self._wake_w, b"\0")
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                readable, _, _ = select.select([self._fd, self._wake_r], [], [])
+                if self._fd not in readable:
+                    continue
+                data = os.read(self._fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                if not self._stopped.is_set():
+                    logging.error(f"Error reading inotify events: {e}")
+                return
+            self._handle(data)
+
+    def _handle(self, data: bytes) -> None:
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + name_length
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify event queue overflowed, invalidating all watched roots")
+                for root in self.roots:
+                    publish_change(root)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self._directories.discard(self._watches.pop(wd, directory))
+                continue
+            if not name:
+                # Event on the watched directory itself, e.g. it was deleted
+                publish_change(directory)
+                continue
+            name = os.fsdecode(name)
+            if _is_excluded(name, self.exclude):
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_tree(path)
+                    except OSError as e:
+                        logging.warning(f"Not watching new directory {path}, cached file data is now checked on every use: {e}")
+                        self.active = False
+            publish_change(path)
+
+
+class PollingWatcher:
+    """
+    Watches directory trees by periodically comparing the mtime and size of every entry.
+
+    Used where inotify is not available. Changes are noticed at most one interval late.
+    """
+
+    def __init__(self, roots: Iterable[str], exclude: List[str], interval: float):
+        self.roots = sorted(set(roots))
+        self.exclude = exclude
+        self.interval = interval
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # Cleared when the trees grew past POLL_MAX_ENTRIES and polling stopped
+        self.active = True
+
+    def _scan(self) -> Optional[Dict[str, Tuple[int, int]]]:
+        """
+        Snapshot the trees, None if they have more than POLL_MAX_ENTRIES entries
+        """
+        snapshot = {}
+        stack = list(self.roots)
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if _is_excluded(entry.name, self.exclude):
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+                        if len(snapshot) > POLL_MAX_ENTRIES:
+                            return None
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return snapshot
+
+    def watches(self, path: str) -> bool:
+        """
+        Changes are published up to one interval late, too late for cached values to rely on
+        """
+        return False
+
+    def start(self) -> None:
+        snapshot = self._scan()
+        if snapshot is None:
+            raise OSError(f"More than {POLL_MAX_ENTRIES} entries to poll")
+        self._snapshot = snapshot
+        self._thread = threading.Thread(target=self._run, name="fs-watcher", daemon=True)
+        self._thread.start()
+        logging.info(f"Polling {len(self._snapshot)} entries every {self.interval} seconds")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            snapshot = self._scan()
+            if snapshot is None:
+                logging.warning(f"More than {POLL_MAX_ENTRIES} entries to poll, no longer watching for changes")
+                self.active = False
+                for root in self.roots:
+                    publish_change(root)
+                return
+            old = self._snapshot
+            self._snapshot = snapshot
+            for path, state in snapshot.items():
+                if old.get(path) != state:
+                    publish_change(path)
+            for path in old.keys() - snapshot.keys():
+                publish_change(path)
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+# Incremented whenever the watcher is replaced, so a watcher that finishes starting late is discarded
+_watcher_generation = 0
+_roots_provider: Optional[Callable[[], Iterable[str]]] = None
+_watcher_listening = False
+
+
+def _create_watcher(roots: List[str]):
+    config = get_config_manager()
+    exclude = config.get_value("fs_watcher_exclude")
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDE
+    interval = config.get_value("fs_watcher_poll_interval") or DEFAULT_POLL_INTERVAL
+    if sys.platform.startswith("linux"):
+        watcher = None
+        try:
+            watcher = InotifyWatcher(roots, exclude)
+            watcher.start()
+            return watcher
+        except (OSError, AttributeError) as e:
+            if watcher is not None:
+                watcher.stop()
+            logging.warning(f"inotify is not available, falling back to polling: {e}")
+    watcher = PollingWatcher(roots, exclude, interval)
+    watcher.start()
+    return watcher
+
+
+def _start_watcher(roots: List[str], generation: int) -> None:
+    global _watcher
+    try:
+        watcher = _create_watcher(roots)
+    except Exception as e:
+        logging.warning(f"Not watching for changes: {e}")
+        return
+    # Values cached before the watcher started may already be stale, drop them before
+    # the watcher is trusted
+    for root in roots:
+        publish_change(root)
+    with _watcher_lock:
+        if generation != _watcher_generation:
+            watcher.stop()
+            return
+        _watcher = watcher
+
+
+def _on_config_change(keys: Set[str]) -> None:
+    if keys & {"allowed_directories", "fs_watcher_enabled", "fs_watcher_exclude", "fs_watcher_poll_interval"}:
+        if _roots_provider is not None:
+            start_watcher(_roots_provider)
+
+
+def start_watcher(roots_provider: Callable[[], Iterable[str]]) -> None:
+    """
+    Start watching the allowed directories, replacing a running watcher
+
+    The directory trees are walked to set up the watches on a background thread, so this
+    returns immediately. Nothing is watched unless fs_watcher_enabled is on, nor when every
+    path is allowed.
+
+    :param roots_provider: Returns the normalized allowed directories, called again when they change
+    """
+    global _watcher, _roots_provider, _watcher_listening, _watcher_generation
+    config = get_config_manager()
+    # Outside the lock, the provider may update the configuration and notify _on_config_change
+    roots = list(roots_provider())
+    with _watcher_lock:
+        _roots_provider = roots_provider
+        if not _watcher_listening:
+            config.add_listener(_on_config_change)
+            _watcher_listening = True
+        _watcher_generation += 1
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
+        if config.get_value("fs_watcher_enabled") is not True:
+            return
+        if not roots or any(root in ("", os.sep) for root in roots):
+            logging.info("Every path is allowed, not watching for changes")
+            return
+        threading.Thread(
+            target=_start_watcher, args=(roots, _watcher_generation), name="fs-watcher-start", daemon=True
+        ).start()
+
+
+def stop_watcher() -> None:
+    global _watcher, _watcher_generation
+    with _watcher_lock:
+        _watcher_generation += 1
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
+
+
+def is_tree_watched(root: str, exclude: Iterable[str]) -> bool:
+    """
+    Check if changes anywhere below a directory are published by a running watcher, except
+    in entries matching the exclude patterns
+
+    :param root: The normalized directory to check
+    :param exclude: Glob patterns of entries the caller does not need to be watched
+    """
+    watcher = _watcher
+    return watcher is not None and watcher.watches(root) and set(watcher.exclude) <= set(exclude)
+
+
+def is_watched(path: str) -> bool:
+    """
+    Check if changes to a path are published by a running watcher, so values cached for
+    it stay valid until it is published
+
+    :param path: The normalized path to check
+    """
+    watcher = _watcher
+    return watcher is not None and watcher.watches(path)
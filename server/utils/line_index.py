@@ -0,0 +1,161 @@
+import os
+import threading
+from array import array
+from collections import deque
+from itertools import islice
+from typing import BinaryIO, TextIO, Tuple
+
+from server.utils.file_cache import FileCache, FileIdentity
+from server.utils.fs_watcher import add_change_listener
+
+# Record the byte offset of every LINE_INDEX_INTERVAL-th line
+LINE_INDEX_INTERVAL = 1000
+LINE_INDEX_CACHE_SIZE = 64
+# Block size used when reading backwards from the end of a file
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+class LineIndex:
+    """
+    Sparse line-offset index of a text file.
+
+    checkpoints[k] is the byte offset where line k * interval starts. The index is
+    filled in lazily while the file is scanned, so it only ever covers the part of
+    the file that has already been read.
+    """
+
+    def __init__(self, interval: int = LINE_INDEX_INTERVAL):
+        self.interval = interval
+        self.checkpoints = array('q', [0])
+        self._lock = threading.Lock()
+
+    def nearest(self, line: int) -> Tuple[int, int]:
+        """
+        Get the closest known checkpoint at or before a line
+
+        :param line: The line number to look up
+        :return: A (line number, byte offset) tuple to start scanning from
+        """
+        with self._lock:
+            ind = min(line // self.interval, len(self.checkpoints) - 1)
+            return ind * self.interval, self.checkpoints[ind]
+
+    def record(self, line: int, byte_offset: int) -> None:
+        """
+        Record the byte offset of a line if it is the next missing checkpoint
+
+        :param line: The line number, must be a multiple of the interval
+        :param byte_offset: The byte offset where the line starts
+        """
+        with self._lock:
+            if line == len(self.checkpoints) * self.interval:
+                self.checkpoints.append(byte_offset)
+
+
+_line_indexes = FileCache(max_entries=LINE_INDEX_CACHE_SIZE)
+add_change_listener(_line_indexes.invalidate)
+
+
+def get_line_index(path: str, identity: FileIdentity) -> LineIndex:
+    """
+    Get the cached line index of a file, creating an empty one if needed
+
+    :param path: The normalized path to the file
+    :param identity: The identity of the file, see file_identity
+    :return: The line index for this version of the file
+    """
+    index = _line_indexes.get(path, identity)
+    if index is None:
+        index = LineIndex()
+        _line_indexes.put(path, identity, index)
+    return index
+
+
+def read_lines(f: BinaryIO, index: LineIndex, offset: int, length: int) -> bytes:
+    """
+    Read a window of lines from a binary file, seeking to the nearest checkpoint first
+
+    Checkpoints passed while scanning are added to the index, so later reads further
+    into the file only scan from the closest checkpoint. Memory is bounded by the window.
+
+    :param f: The file opened in binary mode
+    :param index: The line index of the file
+    :param offset: Number of lines to skip
+    :param length: Maximum number of lines to return
+    :return: The selected raw lines joined together
+    """
+    if length <= 0:
+        return b""
+    line, pos = index.nearest(offset)
+    f.seek(pos)
+    interval = index.interval
+    end = offset + length
+    selected = []
+    for raw in f:
+        if line >= offset:
+            selected.append(raw)
+        line += 1
+        pos += len(raw)
+        if line % interval == 0:
+            index.record(line, pos)
+        if line >= end:
+            break
+    return b"".join(selected)
+
+
+def read_tail_lines(f: BinaryIO, count: int, length: int = None) -> bytes:
+    """
+    Read lines counted from the end of a binary file, reading backwards in blocks
+
+    Only the blocks covering the last count lines are read, so the cost depends on
+    the size of the result rather than the size of the file.
+
+    :param f: The file opened in binary mode
+    :param count: Number of lines from the end of the file to start at
+    :param length: Maximum number of lines to return (default: up to the end of the file)
+    :return: The selected raw lines joined together
+    """
+    if count <= 0 or (length is not None and length <= 0):
+        return b""
+    pos = f.seek(0, os.SEEK_END)
+    if pos == 0:
+        return b""
+    f.seek(pos - 1)
+    # A trailing newline terminates the last line instead of starting a new one
+    trailing_newline = f.read(1) == b"\n"
+    needed = count + 1 if trailing_newline else count
+    blocks = []
+    newlines = 0
+    while pos > 0 and newlines < needed:
+        size = min(TAIL_BLOCK_SIZE, pos)
+        pos -= size
+        f.seek(pos)
+        block = f.read(size)
+        blocks.append(block)
+        newlines += block.count(b"\n")
+    data = b"".join(reversed(blocks))
+    if trailing_newline:
+        data = data[:-1]
+    lines = data.split(b"\n")[-count:]
+    if length is not None and length < len(lines):
+        return b"\n".join(lines[:length]) + b"\n"
+    return b"\n".join(lines) + (b"\n" if trailing_newline else b"")
+
+
+def read_text_lines(f: TextIO, offset: int, length: int) -> str:
+    """
+    Read a window of lines from a file opened in text mode, streaming it line by line
+
+    Used for encodings whose line breaks cannot be found by scanning bytes (e.g. UTF-16),
+    so no index is used. Negative offsets keep only the last lines while scanning.
+
+    :param f: The file opened in text mode
+    :param offset: Number of lines to skip, negative values count back from the end of the file
+    :param length: Maximum number of lines to return
+    :return: The selected lines joined together
+    """
+    if length <= 0:
+        return ""
+    if offset < 0:
+        return ''.join(islice(deque(f, maxlen=-offset), length))
+    return ''.join(islice(f, offset, offset + length))
@@ -0,0 +1,33 @@
+import os
+from typing import Iterable
+
+
+class AllowedDirMatcher:
+    """
+    Matches normalized paths against a set of normalized allowed directories.
+
+    A lookup walks up the ancestors of the path and checks each one against a set of
+    roots, so its cost depends on the depth of the path, not on the number of roots.
+    """
+
+    def __init__(self, allowed_dirs: Iterable[str]):
+        self.roots = frozenset(allowed_dirs)
+        # normalize_path turns "/" into "", both mean every path is allowed
+        self.allow_all = not self.roots or "" in self.roots or os.sep in self.roots
+
+    def matches(self, path: str) -> bool:
+        """
+        Check if the path is one of the allowed directories or inside one of them
+
+        :param path: The normalized path to check
+        :return: True if the path is allowed, False otherwise
+        """
+        if self.allow_all:
+            return True
+        while True:
+            if path in self.roots:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
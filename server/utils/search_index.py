@@ -0,0 +1,437 @@
+import fnmatch
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Set
+
+import numpy as np
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from server.config import get_config_manager
+from server.tools.mime_types import is_searchable_text
+from server.utils.execute_with_timeout import get_parallel_pool
+from server.utils.fs_watcher import add_change_listener, is_tree_watched, remove_change_listener
+
+# Roots that are not watched are re-scanned in the background at most this often
+SEARCH_INDEX_REFRESH_INTERVAL = 30  # seconds
+# At most this many trigrams of the pattern are looked up
+SEARCH_INDEX_MAX_QUERY_TRIGRAMS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    -- 0: never a match (binary), 1: trigrams indexed, 2: too large to index, always a candidate
+    state INTEGER NOT NULL,
+    trigrams BLOB
+);
+-- Excluded entries and symbolic links below the roots, not indexed but searched by walking them
+CREATE TABLE IF NOT EXISTS skipped (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS postings (
+    trigram INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+"""
+
+STATE_SKIPPED = 0
+STATE_INDEXED = 1
+STATE_UNINDEXED = 2
+
+
+def extract_trigrams(data: bytes) -> np.ndarray:
+    """
+    Get the distinct case-folded byte trigrams of some data, encoded as integers
+
+    :param data: The content to index
+    :return: Sorted array of distinct trigrams
+    """
+    if len(data) < 3:
+        return np.empty(0, dtype=np.uint32)
+    arr = np.frombuffer(data.lower(), dtype=np.uint8).astype(np.uint32)
+    return np.unique((arr[:-2] << 16) | (arr[1:-1] << 8) | arr[2:])
+
+
+def _literal_runs(items, runs: List[bytearray]) -> None:
+    for op, value in items:
+        if op == sre_parse.LITERAL:
+            runs[-1].append(value)
+        elif (op == sre_parse.SUBPATTERN and not value[1] & sre_parse.SRE_FLAG_IGNORECASE
+              and not any(o == sre_parse.BRANCH for o, _ in value[-1])):
+            # A plain group is concatenated like the literals around it
+            _literal_runs(value[-1], runs)
+        else:
+            runs.append(bytearray())
+
+
+def required_literals(pattern: bytes, is_regex: bool) -> List[bytes]:
+    """
+    Get literal byte strings that every match of the pattern must contain
+
+    Only literals concatenated at the top level of the regex are used, a pattern with
+    a top-level alternation has no required literals.
+
+    :param pattern: The pattern as bytes
+    :param is_regex: Whether the pattern is a regular expression
+    :return: The required literals, possibly empty
+    """
+    if not is_regex:
+        return [pattern]
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    if any(op == sre_parse.BRANCH for op, _ in parsed):
+        return []
+    runs = [bytearray()]
+    _literal_runs(parsed, runs)
+    return [bytes(run) for run in runs if len(run) >= 3]
+
+
+class SearchIndex:
+    """
+    On-disk trigram index of the text files below a set of root directories.
+
+    Files are indexed by their case-folded byte trigrams in SQLite. A search looks up the
+    trigrams of the literals its pattern requires and only scans files containing all of
+    them. Changed paths published by the file tools and the file system watcher are queued
+    with mark_changed and applied before the next search.
+
+    Changes made outside of the server are only seen through the watcher, so the index is
+    only used while every root is watched. Otherwise, and while a refresh re-scans the
+    roots on the pool, searches walk the tree instead.
+    """
+
+    def __init__(self, db_path: str, roots: Iterable[str], exclude: List[str], max_file_size: int):
+        self.db_path = db_path
+        self.roots = sorted(set(roots))
+        self.exclude = exclude
+        self.max_file_size = max_file_size
+        self._lock = threading.RLock()
+        self._last_refresh = 0.0
+        self._rescan = False
+        # Until the first full build has finished, searches do not use the index
+        self._ready = False
+        self._building = False
+        # Paths changed through the file tools, applied before the next search
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def covers(self, path: str) -> bool:
+        """
+        Check if a path is inside one of the indexed roots
+        """
+        return any(path == root or path.startswith(root + os.sep) for root in self.roots)
+
+    def _excluded_part(self, path: str) -> Optional[str]:
+        """
+        Get the outermost excluded entry a covered path is (or is inside of), None if it is not excluded
+        """
+        for root in self.roots:
+            if path.startswith(root + os.sep):
+                current = root
+                for part in os.path.relpath(path, root).split(os.sep):
+                    current = os.path.join(current, part)
+                    if any(fnmatch.fnmatch(part, pattern) for pattern in self.exclude):
+                        return current
+        return None
+
+    def is_excluded(self, path: str) -> bool:
+        return self._excluded_part(path) is not None
+
+    def _iter_files(self, skipped: Set[str]) -> Iterable[os.DirEntry]:
+        """
+        Iterate over the files to index, collecting the excluded entries and symbolic links in skipped
+        """
+        stack = list(self.roots)
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if any(fnmatch.fnmatch(entry.name, pattern) for pattern in self.exclude) or entry.is_symlink():
+                            skipped.add(entry.path)
+                        elif entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+            except OSError as e:
+                logging.warning(f"Skipping directory while indexing {directory}: {e}")
+
+    def refresh(self) -> None:
+        """
+        Re-index files whose mtime or size changed and drop files that no longer exist
+        """
+        with self._lock:
+            self._rescan = False
+            known = {
+                path: (mtime_ns, size)
+                for path, mtime_ns, size in self._conn.execute("SELECT path, mtime_ns, size FROM files")
+            }
+            seen = set()
+            skipped = set()
+            for entry in self._iter_files(skipped):
+                seen.add(entry.path)
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if known.get(entry.path) != (st.st_mtime_ns, st.st_size):
+                    self._index_file(entry.path, st)
+            for path in known.keys() - seen:
+                if self.covers(path):
+                    self._remove_file(path)
+            self._conn.execute("DELETE FROM skipped")
+            self._conn.executemany("INSERT INTO skipped (path) VALUES (?)", ((path,) for path in skipped))
+            self._conn.commit()
+            self._last_refresh = time.monotonic()
+            self._ready = True
+
+    def _build(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error(f"Error building search index: {e}")
+        finally:
+            self._building = False
+
+    def _start_refresh(self) -> None:
+        """
+        Refresh the index on the pool, unless a refresh is already running
+        """
+        if not self._building:
+            self._building = True
+            get_parallel_pool().submit(self._build)
+
+    def _is_watched(self) -> bool:
+        return all(is_tree_watched(root, self.exclude) for root in self.roots)
+
+    def mark_changed(self, path: str) -> None:
+        """
+        Record that a file or directory was written, moved or deleted
+
+        This only queues the path, it is re-indexed before the next search, so writes
+        never wait for the index.
+
+        :param path: The normalized path that changed
+        """
+        if not self.covers(path):
+            return
+        # A change inside an excluded tree only matters if the tree itself appeared or went away
+        path = self._excluded_part(path) or path
+        with self._dirty_lock:
+            self._dirty.add(path)
+
+    def _apply_changes(self) -> None:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            if self.is_excluded(path) or os.path.islink(path):
+                self._remove_tree(path)
+                if os.path.lexists(path):
+                    self._conn.execute("INSERT OR IGNORE INTO skipped (path) VALUES (?)", (path,))
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._remove_tree(path)
+                continue
+            if os.path.isdir(path):
+                # A whole tree appeared, pick it up with a refresh
+                self._rescan = True
+            else:
+                self._index_file(path, st)
+        self._conn.commit()
+
+    def _remove_tree(self, path: str) -> None:
+        self._remove_file(path)
+        prefix_range = (path + os.sep, path + chr(ord(os.sep) + 1))
+        rows = self._conn.execute("SELECT path FROM files WHERE path >= ? AND path < ?", prefix_range).fetchall()
+        for (child,) in rows:
+            self._remove_file(child)
+        self._conn.execute("DELETE FROM skipped WHERE path = ? OR (path >= ? AND path < ?)", (path,) + prefix_range)
+
+    def _index_file(self, path: str, st: os.stat_result) -> None:
+        self._remove_file(path)
+        trigrams = None
+        if not is_searchable_text(path):
+            state = STATE_SKIPPED
+        elif st.st_size > self.max_file_size:
+            state = STATE_UNINDEXED
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    trigrams = extract_trigrams(f.read())
+            except OSError as e:
+                logging.warning(f"Skipping file while indexing {path}: {e}")
+                return
+            state = STATE_INDEXED
+        cursor = self._conn.execute(
+            "INSERT INTO files (path, mtime_ns, size, state, trigrams) VALUES (?, ?, ?, ?, ?)",
+            (path, st.st_mtime_ns, st.st_size, state, trigrams.tobytes() if trigrams is not None else None)
+        )
+        if trigrams is not None:
+            file_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO postings (trigram, file_id) VALUES (?, ?)",
+                ((int(t), file_id) for t in trigrams)
+            )
+
+    def _remove_file(self, path: str) -> None:
+        row = self._conn.execute("SELECT id, trigrams FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        file_id, trigrams = row
+        if trigrams:
+            self._conn.executemany(
+                "DELETE FROM postings WHERE trigram = ? AND file_id = ?",
+                ((int(t), file_id) for t in np.frombuffer(trigrams, dtype=np.uint32))
+            )
+        self._conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def unindexed(self, root: str) -> Optional[List[str]]:
+        """
+        Get the excluded entries and symbolic links below root, which are not in the index
+        and have to be walked, as of the last call to candidates
+
+        :param root: The normalized directory being searched, must be covered by the index
+        :return: The paths, or None if root itself is excluded or inside one of them
+        """
+        if self.is_excluded(root):
+            return None
+        ancestors = []
+        current = root
+        while self.covers(current) and current not in self.roots:
+            ancestors.append(current)
+            current = os.path.dirname(current)
+        with self._lock:
+            if ancestors:
+                placeholders = ",".join("?" * len(ancestors))
+                if self._conn.execute(f"SELECT 1 FROM skipped WHERE path IN ({placeholders})", ancestors).fetchone():
+                    return None
+            return [
+                path for (path,) in self._conn.execute(
+                    "SELECT path FROM skipped WHERE path >= ? AND path < ?",
+                    (root + os.sep, root + chr(ord(os.sep) + 1))
+                )
+            ]
+
+    def candidates(self, root: str, literals: List[bytes]) -> Optional[Set[str]]:
+        """
+        Get the indexed files below root that may contain all the literals, see unindexed
+        for the entries the index leaves out
+
+        :param root: The normalized directory being searched, must be covered by the index
+        :param literals: Literals every match contains, see required_literals
+        :return: The candidate paths, or None if the literals cannot narrow the search or the
+                 index may be missing changes
+        """
+        wanted = set()
+        for literal in literals:
+            wanted.update(int(t) for t in extract_trigrams(literal))
+        if not wanted:
+            return None
+        # A refresh holds the lock while it re-scans the roots, do not wait for it
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if not self._ready:
+                self._start_refresh()
+                return None
+            if not self._is_watched():
+                # Keep the index warm for when the roots are watched again
+                if time.monotonic() - self._last_refresh >= SEARCH_INDEX_REFRESH_INTERVAL:
+                    self._start_refresh()
+                return None
+            self._apply_changes()
+            if self._rescan:
+                # A new tree appeared, it is only indexed by a refresh
+                self._start_refresh()
+                return None
+            prefix_range = (root + os.sep, root + chr(ord(os.sep) + 1))
+            ids = None
+            for trigram in sorted(wanted)[:SEARCH_INDEX_MAX_QUERY_TRIGRAMS]:
+                found = {
+                    file_id
+                    for (file_id,) in self._conn.execute("SELECT file_id FROM postings WHERE trigram = ?", (trigram,))
+                }
+                ids = found if ids is None else ids & found
+                if not ids:
+                    break
+            paths = set()
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                paths.update(
+                    path for (path,) in self._conn.execute(
+                        f"SELECT path FROM files WHERE id IN ({placeholders})", tuple(ids)
+                    )
+                )
+            paths.update(
+                path for (path,) in self._conn.execute(
+                    "SELECT path FROM files WHERE state = ? AND path >= ? AND path < ?",
+                    (STATE_UNINDEXED,) + prefix_range
+                )
+            )
+        finally:
+            self._lock.release()
+        return {p for p in paths if p.startswith(prefix_range[0])}
+
+
+_search_index: Optional[SearchIndex] = None
+_search_index_lock = threading.Lock()
+_search_index_listening = False
+
+
+def _on_config_change(keys: Set[str]) -> None:
+    global _search_index
+    if keys & {"allowed_directories", "search_index_enabled", "search_index_path",
+               "search_index_exclude", "search_index_max_file_size"}:
+        with _search_index_lock:
+            if _search_index is not None:
+                remove_change_listener(_search_index.mark_changed)
+                _search_index.close()
+            _search_index = None
+
+
+def get_search_index(roots: Iterable[str]) -> Optional[SearchIndex]:
+    """
+    Get the search index, or None if search_index_enabled is off
+
+    :param roots: The normalized allowed directories, used when the index is first opened
+    """
+    global _search_index, _search_index_listening
+    config = get_config_manager()
+    with _search_index_lock:
+        if not _search_index_listening:
+            config.add_listener(_on_config_change)
+            _search_index_listening = True
+        if not config.get_value("search_index_enabled"):
+            return None
+        if _search_index is None:
+            # An empty root means every path is allowed, which is not indexed
+            roots = [d for d in roots if d and d != os.sep]
+            db_path = os.path.expanduser(
+                config.get_value("search_index_path") or "~/.cache/mcp_fs_dm/search_index.sqlite3"
+            )
+            exclude = config.get_value("search_index_exclude") or [".git", "node_modules", "__pycache__", ".venv"]
+            max_file_size = config.get_value("search_index_max_file_size") or 4 * 1024 * 1024
+            _search_index = SearchIndex(db_path, roots, exclude, max_file_size)
+            add_change_listener(_search_index.mark_changed)
+        return _search_index
@@ -0,0 +1,241 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Registers of a HyperLogLog sketch are indexed by the top HLL_PRECISION bits of the hash,
+# 2**14 registers give a standard error of about 0.8%
+HLL_PRECISION = 14
+# Centroids kept by a t-digest, more centroids give more accurate quantiles
+TDIGEST_COMPRESSION = 200
+# Values counted by the heavy hitters sketch of a non-numeric column
+TOP_VALUES_CAPACITY = 1024
+
+
+class RunningStats:
+    """
+    Count, sum, min, max and variance of a numeric column, the statistics of each chunk
+    are merged into the running ones.
+
+    The variance uses Welford's running mean and sum of squared deviations, merged with
+    the pairwise update of Chan et al., which stays accurate where sum(x**2) - n * mean**2
+    would cancel out.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add a chunk of values, without missing values
+        """
+        n = len(values)
+        if not n:
+            return
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        low, high = float(values.min()), float(values.max())
+        self._merge(n, float(values.sum()), mean, m2, low, high)
+
+    def _merge(self, n: int, total: float, mean: float, m2: float, low: float, high: float) -> None:
+        count = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / count
+        self.m2 += m2 + delta * delta * self.count * n / count
+        self.count = count
+        self.sum += total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    @property
+    def std(self) -> Optional[float]:
+        """
+        The sample standard deviation, like pandas.Series.std
+        """
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+class HyperLogLog:
+    """
+    Approximate distinct count in a fixed 2**HLL_PRECISION bytes, whatever the number of values
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series) -> None:
+        """
+        Add a chunk of values, without missing values
+        """
+        if not len(values):
+            return
+        hashes = pd.util.hash_array(values.to_numpy())
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.intp)
+        # The remaining bits fit in the mantissa of a float64, so log2 gives the exact leading bit
+        rest = (hashes & np.uint64((1 << bits) - 1)).astype(np.float64)
+        rank = np.full(len(rest), bits + 1, dtype=np.uint8)
+        nonzero = rest > 0
+        rank[nonzero] = bits - np.floor(np.log2(rest[nonzero])).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.exp2(-self.registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TDigest:
+    """
+    Approximate quantiles from at most about TDIGEST_COMPRESSION weighted centroids.
+
+    Centroids are small near the ends of the distribution and large in the middle (the k1
+    scale function), so extreme quantiles stay accurate. Each chunk is merged with the
+    current centroids in one vectorized pass.
+    """
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add a chunk of values, without missing values
+        """
+        if not len(values):
+            return
+        values = values.astype(np.float64, copy=False)
+        low, high = float(values.min()), float(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        # Points within one unit of the k1 scale function form one centroid
+        k = self.compression * (np.arcsin(np.clip(2 * q - 1, -1, 1)) / np.pi + 0.5)
+        bucket = np.minimum(np.floor(k).astype(np.intp), self.compression - 1)
+        new_weights = np.bincount(bucket, weights=weights)
+        new_sums = np.bincount(bucket, weights=weights * means)
+        used = new_weights > 0
+        self.weights = new_weights[used]
+        self.means = new_sums[used] / self.weights
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        if not len(self.means):
+            return [None] * len(qs)
+        cumulative = np.cumsum(self.weights)
+        centers = (cumulative - self.weights / 2) / cumulative[-1]
+        xs = np.concatenate([[0.0], centers, [1.0]])
+        ys = np.concatenate([[self.min], self.means, [self.max]])
+        return [float(v) for v in np.interp(qs, xs, ys)]
+
+
+class TopValues:
+    """
+    Approximate most frequent values, counted in at most TOP_VALUES_CAPACITY counters.
+
+    The value counts of each chunk are added to the counters and only the largest ones are
+    kept, a mergeable Misra-Gries/space-saving summary. A value whose counter was dropped
+    and that came back is undercounted by at most the largest count dropped so far, so any
+    value more frequent than rows / capacity is always found.
+    """
+
+    def __init__(self, capacity: int = TOP_VALUES_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+
+    def update(self, values: pd.Series) -> None:
+        """
+        Add a chunk of values, without missing values
+        """
+        if not len(values):
+            return
+        counts = values.value_counts(sort=False)
+        merged = counts if not len(self.counts) else self.counts.add(counts, fill_value=0)
+        if len(merged) > self.capacity:
+            merged = merged.nlargest(self.capacity)
+        self.counts = merged.astype(np.int64)
+
+    def top(self) -> Optional[tuple]:
+        """
+        The most frequent value and its (approximate) count, None if no values were added
+        """
+        if not len(self.counts):
+            return None
+        value = self.counts.idxmax()
+        return value, int(self.counts[value])
+
+
+class ColumnAggregate:
+    """
+    Running statistics of one column: counts, distinct count and, for numeric columns,
+    running stats and quantiles, for the others the most frequent value. The memory used
+    does not depend on the number of rows.
+    """
+
+    def __init__(self, dtype: str, numeric: bool):
+        self.dtype = dtype
+        self.numeric = numeric
+        self.null_count = 0
+        self.count = 0
+        self.distinct = HyperLogLog()
+        self.stats = RunningStats() if numeric else None
+        self.digest = TDigest() if numeric else None
+        self.top_values = None if numeric else TopValues()
+
+    def update(self, series: pd.Series) -> None:
+        values = series.dropna()
+        self.null_count += len(series) - len(values)
+        self.count += len(values)
+        self.distinct.update(values)
+        if self.numeric:
+            array = values.to_numpy(dtype=np.float64)
+            self.stats.update(array)
+            self.digest.update(array)
+        else:
+            self.top_values.update(values)
+
+    def result(self, quantiles: List[float]) -> dict:
+        result = {
+            'dtype': self.dtype,
+            'count': self.count,
+            'null_count': self.null_count,
+            # Never report more distinct values than values
+            'distinct': min(self.distinct.estimate(), self.count),
+        }
+        if self.numeric:
+            result.update({
+                'min': self.stats.min,
+                'max': self.stats.max,
+                'mean': self.stats.mean if self.stats.count else None,
+                'std': self.stats.std,
+                'sum': self.stats.sum,
+                'quantiles': {str(q): v for q, v in zip(quantiles, self.digest.quantiles(quantiles))},
+            })
+        else:
+            top = self.top_values.top()
+            if top is not None:
+                result.update({'top': top[0], 'top_count': top[1]})
+        return result
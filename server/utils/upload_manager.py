@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from server.utils.atomic_write import AtomicFile
+
+# Uploads without a chunk for this long are aborted
+UPLOAD_IDLE_TIMEOUT = 600  # seconds
+UPLOAD_MAX_SESSIONS = 64
+# Appending uploads copy the current content of the target in blocks of this size
+UPLOAD_COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadSession:
+    """
+    A file being written in chunks to a temporary file, renamed over the target on commit.
+    """
+
+    def __init__(self, upload_id: str, path: str, target: AtomicFile, encoding: str):
+        self.upload_id = upload_id
+        self.path = path
+        self.target = target
+        # How the chunks are encoded, 'utf-8' or 'base64'
+        self.encoding = encoding
+        self.next_sequence = 0
+        self.size = 0
+        self.last_activity = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        # Set once the current content of the target is copied, for appending uploads
+        self.copied = threading.Event()
+        self.copy_error: Optional[Exception] = None
+
+
+class UploadManager:
+    """
+    Keeps the open chunked uploads. Chunks of one upload are written one at a time and
+    in sequence order, so a retried chunk is written only once.
+    """
+
+    def __init__(self, idle_timeout: float = UPLOAD_IDLE_TIMEOUT, max_sessions: int = UPLOAD_MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [s for s in self._sessions.values() if now - s.last_activity > self.idle_timeout]
+            for session in expired:
+                del self._sessions[session.upload_id]
+        for session in expired:
+            logging.warning(f"Upload {session.upload_id} to {session.path} expired")
+            with session.lock:
+                session.closed = True
+                session.target.abort()
+
+    def open(self, path: str, append: bool, encoding: str, fsync_policy: str) -> UploadSession:
+        """
+        Start an upload to a path
+
+        When appending, the current content of the target is copied to the temporary file
+        in the background while the chunks are written after it, commit waits for the copy.
+
+        :param path: The normalized, validated target path
+        :param append: Whether the chunks are appended to the current content of the file
+        :param encoding: How the chunks are encoded, 'utf-8' or 'base64'
+        :param fsync_policy: The fsync policy applied on commit
+        :return: The new session
+        """
+        self._expire()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise ValueError(f"Too many open uploads, at most {self.max_sessions} are allowed")
+        target = AtomicFile(path, fsync_policy)
+        session = UploadSession(uuid.uuid4().hex, path, target, encoding)
+        try:
+            if append:
+                try:
+                    session.size = os.stat(target.path).st_size
+                except FileNotFoundError:
+                    pass
+            # The chunks are written after the space the current content is copied to
+            target.file.seek(session.size)
+        except Exception:
+            target.abort()
+            raise
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        if session.size:
+            threading.Thread(
+                target=self._copy, args=(session, session.size), name=f"upload-copy-{session.upload_id}", daemon=True
+            ).start()
+        else:
+            session.copied.set()
+        return session
+
+    @staticmethod
+    def _copy(session: UploadSession, size: int) -> None:
+        """
+        Copy the first size bytes of the target to the start of the temporary file, through
+        a separate handle so chunks can be written meanwhile
+        """
+        try:
+            with open(session.target.path, 'rb') as src, open(session.target.temp_path, 'r+b') as dst:
+                remaining = size
+                while remaining and not session.closed:
+                    block = src.read(min(UPLOAD_COPY_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise ValueError(f"File shrank while its content was copied: {session.path}")
+                    dst.write(block)
+                    remaining -= len(block)
+        except Exception as e:
+            logging.error(f"Error copying {session.path} for upload {session.upload_id}: {e}")
+            session.copy_error = e
+        finally:
+            if session.closed:
+                # Aborted or expired while copying, the temporary file may still have been open
+                session.target.abort()
+            session.copied.set()
+
+    def get(self, upload_id: str) -> UploadSession:
+        self._expire()
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            raise ValueError(f"Upload not found: {upload_id}")
+        return session
+
+    def write(self, upload_id: str, sequence: int, data: bytes) -> UploadSession:
+        """
+        Write a chunk of an upload
+
+        :param upload_id: The id returned when the upload was opened
+        :param sequence: The 0-based number of the chunk, a chunk already written is ignored
+        :param data: The content of the chunk
+        :return: The session
+        """
+        session = self.get(upload_id)
+        with session.lock:
+            if session.closed:
+                raise ValueError(f"Upload not found: {upload_id}")
+            session.last_activity = time.monotonic()
+            if sequence < session.next_sequence:
+                # A retried chunk that was already written
+                return session
+            if sequence > session.next_sequence:
+                raise ValueError(f"Expected chunk {session.next_sequence} of upload {upload_id}, got {sequence}")
+            session.target.write(data)
+            session.size += len(data)
+            session.next_sequence += 1
+        return session
+
+    def _close(self, upload_id: str) -> UploadSession:
+        session = self.get(upload_id)
+        with session.lock:
+            if session.closed:
+                raise ValueError(f"Upload not found: {upload_id}")
+            session.closed = True
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        return session
+
+    def commit(self, upload_id: str, wait: Optional[float] = None) -> UploadSession:
+        """
+        Finish an upload, replacing the target with the uploaded content
+
+        :param upload_id: The id returned when the upload was opened
+        :param wait: Seconds to wait for the current content of an appending upload to be
+                     copied, the upload stays open if it is not copied by then (default: no limit)
+        :return: The session
+        """
+        session = self.get(upload_id)
+        if not session.copied.wait(wait):
+            raise ValueError(f"Upload {upload_id} is still copying the current content of {session.path}, commit it again later")
+        session = self._close(upload_id)
+        with session.lock:
+            if session.copy_error is not None:
+                session.target.abort()
+                raise ValueError(f"Error copying the current content of {session.path}: {session.copy_error}")
+            session.target.commit()
+        return session
+
+    def abort(self, upload_id: str) -> UploadSession:
+        """
+        Discard an upload, the target is left untouched
+        """
+        session = self._close(upload_id)
+        with session.lock:
+            session.target.abort()
+        return session
+
+
+upload_manager = UploadManager()
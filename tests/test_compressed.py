@@ -0,0 +1,34 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from server.utils.compressed import DECOMPRESS_CHUNK_SIZE, read_compressed_lines
+
+
+class ReadCompressedLinesTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.gz')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write(self, lines):
+        with gzip.open(self.path, 'wb') as f:
+            f.write(b''.join(lines))
+
+    def test_line_longer_than_a_decompressed_chunk(self):
+        # Hex of random bytes hardly compresses, so the long line spans several reads whose
+        # decompressed output has no line break
+        long_line = os.urandom(6 * DECOMPRESS_CHUNK_SIZE).hex().encode('ascii') + b'\n'
+        lines = [b'%d\n' % i for i in range(5)] + [long_line] + [b'%d\n' % i for i in range(5, 10)]
+        self.write(lines)
+        content = read_compressed_lines(self.path, 'gzip', 0, 100, 'utf-8')
+        self.assertEqual(content.encode('utf-8'), b''.join(lines))
+        self.assertEqual(read_compressed_lines(self.path, 'gzip', 5, 1, 'utf-8').encode('utf-8'), long_line)
+        self.assertEqual(read_compressed_lines(self.path, 'gzip', 6, 2, 'utf-8'), '5\n6\n')
+
+
+if __name__ == '__main__':
+    unittest.main()